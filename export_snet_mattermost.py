@@ -6,18 +6,28 @@ Run this from command line where you can enter your password.
 
 import os
 import sys
-import json
 import getpass
+import argparse
 from pathlib import Path
 from datetime import datetime
 
 # Add current directory to path
 sys.path.insert(0, str(Path(__file__).parent))
 
-from mattermost_export import MattermostExporter
+from mattermost_export import (
+    ExportJournal, add_export_arguments, add_workspace_arguments, build_exporter,
+    export_workspace, open_export_journal
+)
 
 
 def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    add_export_arguments(parser)
+    add_workspace_arguments(parser)
+    args = parser.parse_args()
+    if args.resume and not (args.resume / ExportJournal.FILE_NAME).exists():
+        parser.error(f"no interrupted export to resume in {args.resume}")
+
     print("\n" + "="*60)
     print(" SingularityNET Mattermost Exporter")
     print("="*60 + "\n")
@@ -38,21 +48,21 @@ def main():
         print("Error: Password required")
         sys.exit(1)
 
-    # Create output directory
+    # Create output directory (or reuse the interrupted one)
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    output_dir = Path("mattermost_exports") / f"singularitynet_{timestamp}"
-    output_dir.mkdir(parents=True, exist_ok=True)
-    print(f"\nOutput directory: {output_dir.absolute()}\n")
+    exports_root = Path("mattermost_exports")
+    output_dir = args.resume or exports_root / f"singularitynet_{timestamp}"
+    if not args.dry_run:
+        output_dir.mkdir(parents=True, exist_ok=True)
+        print(f"\nOutput directory: {output_dir.absolute()}\n")
 
     try:
         # Initialize exporter
         print("Connecting to Mattermost...")
-        exporter = MattermostExporter(
-            host=config["host"],
-            username=config["username"],
-            password=password
-        )
-        exporter.initialize_user_data()
+        credentials = {"username": config["username"], "password": password}
+        exporter = build_exporter(args, config["host"], exports_root, **credentials)
+        exporter.initialize_user_data(load_all_users=args.all_users)
+        journal = None if args.dry_run else open_export_journal(args, output_dir)
 
         # Get all teams
         teams = exporter.list_teams()
@@ -61,59 +71,14 @@ def main():
         for idx, team in enumerate(teams):
             print(f"  [{idx}] {team['display_name']}")
 
-        # Process each team
-        for team_idx, team in enumerate(teams):
-            print(f"\n{'='*60}")
-            print(f"Processing Team {team_idx + 1}/{len(teams)}: {team['display_name']}")
-            print(f"{'='*60}")
-
-            # Get all channels for this team
-            channels = exporter.list_channels(team["id"])
-
-            if not channels:
-                print("  No channels found")
-                continue
-
-            # Export each channel
-            for channel_idx, channel in enumerate(channels):
-                print(f"\n[Channel {channel_idx + 1}/{len(channels)}]")
-                try:
-                    exporter.export_channel(
-                        channel,
-                        output_dir,
-                        download_files=config["download_files"]
-                    )
-                except Exception as e:
-                    print(f"✗ Error exporting {channel['display_name']}: {e}")
-                    continue
-
-        # Create summary
-        summary = {
-            "host": config["host"],
-            "username": config["username"],
-            "exported_at": datetime.utcnow().isoformat() + "Z",
-            "teams_count": len(teams),
-            "teams": [
-                {
-                    "name": team["name"],
-                    "display_name": team["display_name"],
-                    "id": team["id"]
-                }
-                for team in teams
-            ]
-        }
-
-        summary_file = output_dir / "export_summary.json"
-        summary_file.write_text(json.dumps(summary, indent=2), encoding="utf-8")
-
-        print("\n" + "="*60)
-        print("✓ Export Complete!")
-        print(f"  Output: {output_dir.absolute()}")
-        print(f"  Summary: {summary_file}")
-        print("="*60 + "\n")
+        export_workspace(exporter, teams, args, output_dir, exports_root,
+                         config["host"], credentials, journal,
+                         download_files=config["download_files"],
+                         summary_fields={"username": config["username"]})
 
     except KeyboardInterrupt:
         print("\n\n✗ Export cancelled by user")
+        print(f"  Resume with: --resume {output_dir}")
         sys.exit(1)
     except Exception as e:
         print(f"\n✗ Error: {e}")
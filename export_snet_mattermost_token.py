@@ -12,17 +12,27 @@ To get your token:
 
 import os
 import sys
-import json
+import argparse
 from pathlib import Path
 from datetime import datetime
 
 # Add current directory to path
 sys.path.insert(0, str(Path(__file__).parent))
 
-from mattermost_export import MattermostExporter
+from mattermost_export import (
+    ExportJournal, add_export_arguments, add_workspace_arguments, build_exporter,
+    export_workspace, open_export_journal
+)
 
 
 def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    add_export_arguments(parser)
+    add_workspace_arguments(parser)
+    args = parser.parse_args()
+    if args.resume and not (args.resume / ExportJournal.FILE_NAME).exists():
+        parser.error(f"no interrupted export to resume in {args.resume}")
+
     print("\n" + "="*60)
     print(" SingularityNET Mattermost Exporter (Token Auth)")
     print("="*60 + "\n")
@@ -47,20 +57,21 @@ def main():
         print("Error: Token required")
         sys.exit(1)
 
-    # Create output directory
+    # Create output directory (or reuse the interrupted one)
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    output_dir = Path("mattermost_exports") / f"singularitynet_{timestamp}"
-    output_dir.mkdir(parents=True, exist_ok=True)
-    print(f"\nOutput directory: {output_dir.absolute()}\n")
+    exports_root = Path("mattermost_exports")
+    output_dir = args.resume or exports_root / f"singularitynet_{timestamp}"
+    if not args.dry_run:
+        output_dir.mkdir(parents=True, exist_ok=True)
+        print(f"\nOutput directory: {output_dir.absolute()}\n")
 
     try:
         # Initialize exporter with token
         print("Connecting to Mattermost...")
-        exporter = MattermostExporter(
-            host=config["host"],
-            token=token
-        )
-        exporter.initialize_user_data()
+        credentials = {"token": token}
+        exporter = build_exporter(args, config["host"], exports_root, **credentials)
+        exporter.initialize_user_data(load_all_users=args.all_users)
+        journal = None if args.dry_run else open_export_journal(args, output_dir)
 
         # Get all teams
         teams = exporter.list_teams()
@@ -69,82 +80,37 @@ def main():
         for idx, team in enumerate(teams):
             print(f"  [{idx}] {team['display_name']}")
 
-        # Ask which teams to export
-        print("\nExport options:")
-        print("  'all' - Export all teams")
-        print("  '0,1,2' - Export specific teams by number")
-        choice = input("\nEnter your choice: ").strip().lower()
-
-        if choice == 'all':
-            teams_to_export = teams
+        if journal and journal.meta:
+            # Resumed run: export the teams the interrupted run selected
+            team_ids = set(journal.meta["teams"])
+            teams_to_export = [team for team in teams if team["id"] in team_ids]
+            print(f"\nResuming export of {len(teams_to_export)} team(s)")
         else:
-            try:
-                indices = [int(x.strip()) for x in choice.split(",")]
-                teams_to_export = [teams[i] for i in indices if 0 <= i < len(teams)]
-            except (ValueError, IndexError):
-                print("Invalid selection. Exporting all teams.")
-                teams_to_export = teams
-
-        # Process each team
-        total_channels = 0
-        for team_idx, team in enumerate(teams_to_export):
-            print(f"\n{'='*60}")
-            print(f"Processing Team {team_idx + 1}/{len(teams_to_export)}: {team['display_name']}")
-            print(f"{'='*60}")
+            # Ask which teams to export
+            print("\nExport options:")
+            print("  'all' - Export all teams")
+            print("  '0,1,2' - Export specific teams by number")
+            choice = input("\nEnter your choice: ").strip().lower()
 
-            # Get all channels for this team
-            channels = exporter.list_channels(team["id"])
-
-            if not channels:
-                print("  No channels found")
-                continue
-
-            total_channels += len(channels)
-
-            # Export each channel
-            for channel_idx, channel in enumerate(channels):
-                print(f"\n[Channel {channel_idx + 1}/{len(channels)}]")
+            if choice == 'all':
+                teams_to_export = teams
+            else:
                 try:
-                    exporter.export_channel(
-                        channel,
-                        output_dir,
-                        download_files=config["download_files"]
-                    )
-                except Exception as e:
-                    print(f"✗ Error exporting {channel['display_name']}: {e}")
-                    import traceback
-                    traceback.print_exc()
-                    continue
-
-        # Create summary
-        summary = {
-            "host": config["host"],
-            "exported_at": datetime.utcnow().isoformat() + "Z",
-            "teams_count": len(teams_to_export),
-            "total_channels": total_channels,
-            "teams": [
-                {
-                    "name": team["name"],
-                    "display_name": team["display_name"],
-                    "id": team["id"]
-                }
-                for team in teams_to_export
-            ]
-        }
-
-        summary_file = output_dir / "export_summary.json"
-        summary_file.write_text(json.dumps(summary, indent=2), encoding="utf-8")
-
-        print("\n" + "="*60)
-        print("✓ Export Complete!")
-        print(f"  Output: {output_dir.absolute()}")
-        print(f"  Teams: {len(teams_to_export)}")
-        print(f"  Channels: {total_channels}")
-        print(f"  Summary: {summary_file.name}")
-        print("="*60 + "\n")
+                    indices = [int(x.strip()) for x in choice.split(",")]
+                    teams_to_export = [teams[i] for i in indices if 0 <= i < len(teams)]
+                except (ValueError, IndexError):
+                    print("Invalid selection. Exporting all teams.")
+                    teams_to_export = teams
+            if journal:
+                journal.start(teams=[team["id"] for team in teams_to_export])
+
+        export_workspace(exporter, teams_to_export, args, output_dir, exports_root,
+                         config["host"], credentials, journal,
+                         download_files=config["download_files"])
 
     except KeyboardInterrupt:
         print("\n\n✗ Export cancelled by user")
+        print(f"  Resume with: --resume {output_dir}")
         sys.exit(1)
     except Exception as e:
         print(f"\n✗ Error: {e}")
@@ -0,0 +1,501 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark for the Mattermost exporter.
+
+Starts a local stand-in Mattermost server (in a separate process) serving a
+synthetic workspace, exports the whole workspace from it with the regular
+export engine, and reports throughput, peak memory and request counts.
+
+The mock implements the API endpoints the exporter uses (users, teams,
+channels, posts, files) including cursor paging, `since` queries, ETags
+and the rate-limit headers, and can inject latency, rate limiting and
+server errors. Nothing is sent to a real server.
+
+Examples:
+  python mattermost_bench.py --posts 20000 --latency 20
+  python mattermost_bench.py --teams 3 --channels 10 --workers 4 --runs 2
+  python mattermost_bench.py --server-rate-limit 50 --fail-every 40 --json bench.json
+"""
+
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import multiprocessing
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Add current directory to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+from mattermost_export import (
+    ExportProcessPool, _format_bytes, add_export_arguments, add_workspace_arguments,
+    attachment_filter_from_args, build_exporter, plan_from_args
+)
+
+# First post timestamp of the synthetic workspace (ms)
+EPOCH_MS = 1_600_000_000_000
+
+
+class Workspace:
+    """A synthetic Mattermost workspace, generated deterministically from a seed."""
+
+    def __init__(self, users: int = 100, teams: int = 2, channels: int = 5,
+                 posts: int = 2000, reply_ratio: float = 0.3, thread_span: int = 20,
+                 files_every: int = 25, file_size: int = 20_000, code_every: int = 10,
+                 seed: int = 1):
+        rnd = random.Random(seed)
+        self.file_size = file_size
+        self.users = [
+            {"id": f"u{i:025d}", "username": f"user{i}", "update_at": EPOCH_MS}
+            for i in range(max(users, 2))
+        ]
+        self.me = self.users[0]
+        self.teams = [
+            {"id": f"t{i:025d}", "name": f"team{i}", "display_name": f"Team {i}"}
+            for i in range(teams)
+        ]
+        self.channels: Dict[str, Dict] = {}
+        self.team_channels: Dict[str, List[Dict]] = {team["id"]: [] for team in self.teams}
+        self.posts: Dict[str, Dict] = {}
+        self.channel_posts: Dict[str, List[str]] = {}
+        self.files: Dict[str, int] = {}
+
+        for team_idx, team in enumerate(self.teams):
+            for channel_idx in range(channels):
+                channel = self._add_channel(f"c{team_idx:05d}{channel_idx:020d}",
+                                            f"{team['name']}-channel{channel_idx}", "O", team["id"])
+                self.team_channels[team["id"]].append(channel)
+
+        # The user's direct and group channels are listed under every team
+        direct = [
+            self._add_channel("d" + "0" * 25, f"{self.me['id']}__{self.users[1]['id']}", "D", ""),
+            self._add_channel("g" + "0" * 25, "group-channel", "G", ""),
+        ]
+        for team in self.teams:
+            self.team_channels[team["id"]] += direct
+
+        count = 0
+        for channel_id, channel in self.channels.items():
+            ids = []
+            roots: List[str] = []
+            for _ in range(posts):
+                count += 1
+                post_id = f"p{count:025d}"
+                created = EPOCH_MS + count * 60_000
+                message = f"Message {count}"
+                if code_every and count % code_every == 0:
+                    message += f"\n```python\nprint({count})\n```"
+                post = {
+                    "id": post_id, "create_at": created, "update_at": created,
+                    "delete_at": 0, "channel_id": channel_id, "root_id": "",
+                    "user_id": rnd.choice(self.users)["id"], "message": message,
+                    "metadata": {},
+                }
+                if roots and rnd.random() < reply_ratio:
+                    post["root_id"] = rnd.choice(roots[-thread_span:])
+                else:
+                    roots.append(post_id)
+                if files_every and count % files_every == 0:
+                    file_id = f"f{count:025d}"
+                    self.files[file_id] = file_size
+                    post["metadata"]["files"] = [{
+                        "id": file_id, "name": f"file{count}.bin", "size": file_size,
+                        "mime_type": "application/octet-stream", "extension": "bin",
+                        "has_preview_image": False,
+                    }]
+                self.posts[post_id] = post
+                ids.append(post_id)
+            self.channel_posts[channel_id] = ids
+            channel["total_msg_count"] = len(ids)
+            channel["last_post_at"] = self.posts[ids[-1]]["create_at"] if ids else 0
+
+    def _add_channel(self, channel_id: str, name: str, kind: str, team_id: str) -> Dict:
+        channel = {
+            "id": channel_id, "name": name, "display_name": name, "type": kind,
+            "team_id": team_id, "header": "", "purpose": "",
+            "total_msg_count": 0, "last_post_at": 0,
+        }
+        self.channels[channel_id] = channel
+        return channel
+
+    def file_bytes(self, file_id: str) -> bytes:
+        """Attachment content (deterministic, distinct per file)."""
+        block = hashlib.sha256(file_id.encode()).digest()
+        size = self.files[file_id]
+        return (block * (size // len(block) + 1))[:size]
+
+    def post_page(self, channel_id: str, query: Dict[str, str]) -> Dict:
+        """Answer a posts-for-channel query (newest first, like the server)."""
+        ids = self.channel_posts[channel_id]
+        per_page = int(query.get("per_page", 60))
+        page = int(query.get("page", 0))
+        if "since" in query:
+            since = int(query["since"])
+            selected = [i for i in ids if self.posts[i]["update_at"] >= since][-1000:]
+        elif "before" in query:
+            end = ids.index(query["before"]) - page * per_page
+            selected = ids[max(0, end - per_page):max(0, end)]
+        elif "after" in query:
+            start = ids.index(query["after"]) + 1 + page * per_page
+            selected = ids[start:start + per_page]
+        else:
+            end = len(ids) - page * per_page
+            selected = ids[max(0, end - per_page):max(0, end)]
+        order = selected[::-1]
+        return {"order": order, "posts": {i: self.posts[i] for i in order},
+                "next_post_id": "", "prev_post_id": ""}
+
+
+class MockServer(ThreadingHTTPServer):
+    """Serves a Workspace over the Mattermost REST API."""
+
+    daemon_threads = True
+
+    def __init__(self, port: int, workspace: Workspace, latency: float = 0.0,
+                 rate_limit: float = 0.0, fail_every: int = 0):
+        super().__init__(("127.0.0.1", port), MockHandler)
+        self.workspace = workspace
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.fail_every = fail_every
+        self.counts: Dict[str, int] = {}
+        self.tokens = rate_limit
+        self.refilled = time.monotonic()
+        self.lock = threading.Lock()
+
+    def admit(self, endpoint: str) -> Optional[int]:
+        """Count a request; return an error status to inject, if any."""
+        with self.lock:
+            self.counts[endpoint] = self.counts.get(endpoint, 0) + 1
+            total = self.counts["_total"] = self.counts.get("_total", 0) + 1
+            if self.rate_limit:
+                now = time.monotonic()
+                self.tokens = min(self.rate_limit,
+                                  self.tokens + (now - self.refilled) * self.rate_limit)
+                self.refilled = now
+                if self.tokens < 1:
+                    self.counts["_429"] = self.counts.get("_429", 0) + 1
+                    return 429
+                self.tokens -= 1
+            if self.fail_every and total % self.fail_every == 0:
+                self.counts["_503"] = self.counts.get("_503", 0) + 1
+                return 503
+        return None
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def end_headers(self):
+        server = self.server
+        if server.rate_limit:
+            self.send_header("X-Ratelimit-Limit", str(int(server.rate_limit)))
+            self.send_header("X-Ratelimit-Remaining", str(int(server.tokens)))
+            self.send_header("X-Ratelimit-Reset", "1")
+        super().end_headers()
+
+    def _send(self, body: bytes, status: int = 200, content_type: str = "application/json",
+              headers: Optional[Dict[str, str]] = None) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _json(self, data, status: int = 200, etag: bool = False) -> None:
+        body = json.dumps(data).encode()
+        if etag:
+            tag = hashlib.md5(body).hexdigest()
+            if self.headers.get("If-None-Match") == tag:
+                self.send_response(304)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self._send(body, status, headers={"ETag": tag})
+        else:
+            self._send(body, status)
+
+    def _handle(self, method: str) -> None:
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"null") if length else None
+
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        parts = url.path.split("/")[3:]  # drop "", "api", "v4"
+
+        if parts == ["__bench", "stats"]:
+            with self.server.lock:
+                return self._json(dict(self.server.counts))
+
+        # Count by endpoint shape, with ids collapsed
+        endpoint = method + " /" + "/".join(
+            "{id}" if len(part) == 26 else part for part in parts
+        )
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        error = self.server.admit(endpoint)
+        if error == 429:
+            return self._send(b'{"message": "Too many requests"}', 429,
+                              headers={"Retry-After": "1"})
+        if error:
+            return self._json({"message": "Injected failure"}, error)
+
+        workspace = self.server.workspace
+        users = {user["id"]: user for user in workspace.users}
+
+        if parts == ["users", "me"]:
+            return self._json(workspace.me)
+        if parts == ["users"]:
+            page, per_page = int(query.get("page", 0)), int(query.get("per_page", 60))
+            return self._json(workspace.users[page * per_page:(page + 1) * per_page])
+        if parts == ["users", "ids"]:
+            since = int(query.get("since", 0))
+            return self._json([users[i] for i in body or [] if i in users
+                               and users[i]["update_at"] > since])
+        if len(parts) == 2 and parts[0] == "users":
+            if parts[1] in users:
+                return self._json(users[parts[1]])
+        elif len(parts) == 3 and parts[0] == "users" and parts[2] == "teams":
+            return self._json(workspace.teams)
+        elif len(parts) == 2 and parts[0] == "teams":
+            for team in workspace.teams:
+                if team["id"] == parts[1]:
+                    return self._json(team, etag=True)
+        elif len(parts) == 5 and parts[2] == "teams" and parts[4] == "channels":
+            if parts[3] in workspace.team_channels:
+                return self._json(workspace.team_channels[parts[3]], etag=True)
+        elif len(parts) == 3 and parts[0] == "channels" and parts[2] == "posts":
+            if parts[1] in workspace.channel_posts:
+                return self._json(workspace.post_page(parts[1], query))
+        elif parts == ["posts", "ids"]:
+            return self._json([workspace.posts[i] for i in body or [] if i in workspace.posts])
+        elif len(parts) == 3 and parts[0] == "posts" and parts[2] == "thread":
+            root = parts[1]
+            thread = [i for i, post in workspace.posts.items()
+                      if i == root or post["root_id"] == root]
+            return self._json({"order": thread,
+                               "posts": {i: workspace.posts[i] for i in thread}})
+        elif parts and parts[0] == "files" and parts[1] in workspace.files:
+            data = workspace.file_bytes(parts[1])
+            if len(parts) == 3:  # preview/thumbnail
+                data = data[:1024]
+            return self._send(data, content_type="application/octet-stream")
+
+        self._json({"message": f"Not found: {url.path}"}, 404)
+
+
+def _serve(workspace_kwargs: Dict, server_kwargs: Dict, ready) -> None:
+    """Server process entry point: build the workspace and serve it."""
+    server = MockServer(0, Workspace(**workspace_kwargs), **server_kwargs)
+    ready.send(server.server_address[1])
+    server.serve_forever()
+
+
+def _peak_rss() -> Optional[int]:
+    """Peak resident set size in bytes of this process or any of its finished
+    worker processes, where available."""
+    if resource is None:
+        return None
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _server_stats(exporter) -> Dict[str, int]:
+    return exporter.driver.client.get("/__bench/stats")
+
+
+def run_export(args: argparse.Namespace, port: int, work_dir: Path, run: int) -> Dict:
+    """Export the whole mock workspace once and return its measurements."""
+    output_dir = work_dir / f"run{run}"
+    connection = {"token": "bench", "port": port, "scheme": "http"}
+    exporter = build_exporter(args, "127.0.0.1", work_dir, **connection)
+    exporter.initialize_user_data(load_all_users=args.all_users)
+    before = _server_stats(exporter)
+
+    # The per-channel progress output would drown the report
+    quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    started = time.perf_counter()
+    with quiet:
+        team_channels, direct_channels, _ = exporter.list_workspace_channels(exporter.list_teams())
+        channels = [channel for team in team_channels.values() for channel in team]
+        channels, _ = plan_from_args(exporter, channels + direct_channels, args)
+        export_kwargs = {
+            "output_format": args.format,
+            "attachment_filter": attachment_filter_from_args(args),
+            "compression": args.compress,
+            "partition": args.partition,
+            "search_index": args.search_index,
+            "download_files": not args.no_files,
+        }
+        pool = None
+        if args.processes > 1:
+            pool = ExportProcessPool(args.processes, args, "127.0.0.1", work_dir, connection)
+            results = pool.export_channels(channels, output_dir, **export_kwargs)
+        else:
+            results = exporter.export_channels(channels, output_dir, workers=args.workers,
+                                               **export_kwargs)
+    elapsed = time.perf_counter() - started
+
+    after = _server_stats(exporter)
+    requests_made = {key: after.get(key, 0) - before.get(key, 0) for key in after}
+    requests_made = {key: count for key, count in requests_made.items() if count}
+
+    metrics = exporter.metrics_report()
+    posts = sum(report["counters"].get("posts_exported", 0)
+                for report in [metrics, *(pool.worker_metrics.values() if pool else [])])
+    return {
+        "run": run,
+        "elapsed_seconds": round(elapsed, 3),
+        "channels": len(channels),
+        "failed_channels": sum(1 for result in results if result["error"]),
+        "posts": posts,
+        "posts_per_second": round(posts / max(elapsed, 1e-6), 1),
+        "peak_rss": _peak_rss(),
+        "requests": requests_made,
+        "metrics": metrics,
+    }
+
+
+def print_run(result: Dict) -> None:
+    requests_made = result["requests"]
+    rss = result["peak_rss"]
+    print(f"\nRun {result['run']}: {result['elapsed_seconds']:.2f} s, "
+          f"{result['posts']:,} posts ({result['posts_per_second']:,.0f} posts/s), "
+          f"{requests_made.get('_total', 0):,} requests "
+          f"({requests_made.get('_429', 0)} throttled, {requests_made.get('_503', 0)} failed), "
+          f"peak RSS {_format_bytes(rss) if rss else 'n/a'}")
+    if result["failed_channels"]:
+        print(f"  ✗ {result['failed_channels']} channel(s) failed")
+    for endpoint, count in sorted(requests_made.items(), key=lambda item: -item[1]):
+        if not endpoint.startswith("_"):
+            print(f"  {endpoint:<50} {count:>8,}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().splitlines()[0],
+        epilog="\n".join(__doc__.strip().splitlines()[-4:]),
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    workspace = parser.add_argument_group("synthetic workspace")
+    workspace.add_argument("--users", type=int, default=100, help="Users (default: 100)")
+    workspace.add_argument("--teams", type=int, default=2, help="Teams (default: 2)")
+    workspace.add_argument("--channels", type=int, default=5,
+                           help="Channels per team, plus one DM and one group channel "
+                                "(default: 5)")
+    workspace.add_argument("--posts", type=int, default=2000,
+                           help="Posts per channel (default: 2000)")
+    workspace.add_argument("--reply-ratio", type=float, default=0.3,
+                           help="Fraction of posts that are thread replies (default: 0.3)")
+    workspace.add_argument("--thread-span", type=int, default=20,
+                           help="Replies go to one of the last N threads; smaller "
+                                "means deeper threads (default: 20)")
+    workspace.add_argument("--files-every", type=int, default=25,
+                           help="Attach a file to every Nth post, 0 for none (default: 25)")
+    workspace.add_argument("--file-size", type=int, default=20_000,
+                           help="Attachment size in bytes (default: 20000)")
+    workspace.add_argument("--seed", type=int, default=1, help="Random seed (default: 1)")
+
+    server = parser.add_argument_group("mock server")
+    server.add_argument("--latency", type=float, default=0.0,
+                        help="Added latency per request in milliseconds (default: 0)")
+    server.add_argument("--server-rate-limit", type=float, default=0.0,
+                        help="Requests per second before answering 429 (default: unlimited)")
+    server.add_argument("--fail-every", type=int, default=0,
+                        help="Answer every Nth request with a 503 (default: never)")
+
+    bench = parser.add_argument_group("benchmark")
+    bench.add_argument("--runs", type=int, default=1,
+                       help="Export the workspace this many times; later runs reuse the "
+                            "metadata cache and blob store (default: 1)")
+    bench.add_argument("--no-files", action="store_true", help="Skip downloading attachments")
+    bench.add_argument("--verbose", action="store_true",
+                       help="Show the exporter's per-channel progress")
+    bench.add_argument("--json", type=Path, help="Write the full results to this file")
+    bench.add_argument("--keep", action="store_true",
+                       help="Keep the benchmark's export directory")
+    add_export_arguments(parser)
+    add_workspace_arguments(parser)
+    args = parser.parse_args()
+
+    work_dir = Path(tempfile.mkdtemp(prefix="mattermost_bench_"))
+    # Never touch the real metadata cache
+    args.cache_db = work_dir / "cache.sqlite"
+
+    workspace_kwargs = {
+        "users": args.users, "teams": args.teams, "channels": args.channels,
+        "posts": args.posts, "reply_ratio": args.reply_ratio,
+        "thread_span": args.thread_span, "files_every": args.files_every,
+        "file_size": args.file_size, "seed": args.seed,
+    }
+    server_kwargs = {
+        "latency": args.latency / 1000, "rate_limit": args.server_rate_limit,
+        "fail_every": args.fail_every,
+    }
+
+    total_posts = args.posts * (args.teams * args.channels + 2)
+    print(f"Workspace: {args.teams} team(s) × {args.channels} channel(s) + DM/group, "
+          f"{args.posts:,} posts each ({total_posts:,} posts), {args.users} users")
+    print("Starting mock server...", end=" ", flush=True)
+    context = multiprocessing.get_context("spawn")
+    ready, ready_send = context.Pipe(duplex=False)
+    server_process = context.Process(target=_serve, daemon=True,
+                                      args=(workspace_kwargs, server_kwargs, ready_send))
+    server_process.start()
+    try:
+        port = ready.recv()
+        print(f"✓ http://127.0.0.1:{port}")
+
+        results = []
+        for run in range(1, args.runs + 1):
+            result = run_export(args, port, work_dir, run)
+            print_run(result)
+            results.append(result)
+
+        if args.json:
+            args.json.write_text(json.dumps({
+                "workspace": workspace_kwargs,
+                "server": server_kwargs,
+                "options": {key: str(value) if isinstance(value, Path) else value
+                            for key, value in vars(args).items()},
+                "runs": results,
+            }, indent=2), encoding="utf-8")
+            print(f"\n✓ Results written to {args.json}")
+    finally:
+        server_process.terminate()
+        if args.keep:
+            print(f"Exports kept in {work_dir}")
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,57 +5,2160 @@ Export channels, messages, and attachments from Mattermost to JSON format.
 
 Features:
 - Export public, private, group, and direct message channels
-- Download file attachments
-- Extract code blocks to separate files
-- Track thread relationships (replies linked to parent posts)
+- Download file attachments (streamed to disk by a parallel pool)
+- Deduplicated attachment storage across channels and runs (blob store)
+- Attachment filters by size and MIME type, or preview-only downloads
+- Extract code blocks (every fence, with its language tag) into one
+  deduplicated code archive per channel with an offset index
+- Track thread relationships (replies linked to parent posts), fetching
+  thread roots outside the exported window in bulk, with a cross-channel
+  thread index (thread_index.sqlite)
 - Date filtering (export posts within specific date ranges)
+- Concurrent export of multiple channels (--workers, or --processes for
+  workspace exports), with post pages
+  prefetched ahead within each channel (--prefetch-pages)
+- Incremental sync of new and edited posts (--incremental)
+- JSON, NDJSON (one post per line) or Parquet (columnar, for analytics)
+  channel output (--format)
+- Time-partitioned channel shards (by month or every N posts) with a
+  per-channel shard index (--partition)
+- Streaming gzip/zstd compression of channel output and compressible
+  attachments (--compress); open_export() reads compressed exports
+- Persistent metadata cache for users, teams and channel lists
+- Optional SQLite FTS5 search index across exports (--search-index)
+- Export planning: cost estimates, largest-first scheduling, skipping
+  unchanged channels (--skip-unchanged) and --dry-run
+- Checkpointed exports that resume after an interruption (--resume)
+- Per-run metrics (phase timings, requests, cache hits, throughput) in
+  export_metrics.json, with optional profiling (--profile)
+- Pooled connections, retries with backoff, and adaptive rate limiting
 - Interactive channel selection
 - Auto-detect Firefox authentication tokens
 - Persistent configuration
 
+Large channels are streamed from the API to disk page by page, so memory
+use does not grow with channel size.
+
 Thread Tracking:
 Posts that are replies in threads include 'root_id' and 'is_reply' fields.
 The export also includes a 'threads' object mapping root post IDs to their replies.
+Roots of replied-to threads that fall outside the export (e.g. before --after)
+are fetched and included under 'thread_roots'.
+
+Post Numbering:
+Each post's 'idx' is its position in the export, oldest first: in the channel's
+whole history for a full export, or from the first post on or after --after
+for a date-bounded one. Attachment files ('<idx>_<name>') and --partition N
+shards are keyed by idx, so they are stable across runs with the same --after;
+incremental syncs keep existing idx values and number new posts after them.
 """
 
+import contextlib
+import cProfile
+import gzip
+import hashlib
+import io
 import os
 import json
+import multiprocessing
+import pstats
+import random
+import shutil
 import sqlite3
-from datetime import datetime
+import threading
+import time
+import traceback
+import tracemalloc
+import uuid
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+from fnmatch import fnmatch
+from itertools import groupby
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from typing import IO, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple, Union
 import getpass
 import argparse
 
 try:
+    import requests
+    from requests.adapters import HTTPAdapter
     from mattermostdriver import Driver
+    from mattermostdriver.client import Client
+    from mattermostdriver.exceptions import (
+        ContentTooLarge, FeatureDisabled, InvalidOrMissingParameters, MethodNotAllowed,
+        NoAccessTokenProvided, NotEnoughPermissions, ResourceNotFound
+    )
 except ImportError:
     print("Error: mattermostdriver not installed. Install with: pip install mattermostdriver")
     exit(1)
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None  # only needed for --compress zstd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None  # only needed for --format parquet
+
+
+# Posts requested per page (the server's maximum)
+POSTS_PER_PAGE = 200
+
+# Most posts the server returns for a `since` query
+SINCE_POST_LIMIT = 1000
+
+# User ids resolved per users-by-ids request
+USER_BATCH_SIZE = 100
+
+# Thread roots fetched per posts-by-ids request
+POST_BATCH_SIZE = 200
+
+# Posts written to the search index per transaction
+SEARCH_BATCH_SIZE = 1000
+
+# Rows per Parquet row group (rows are buffered until a group is full)
+PARQUET_ROW_GROUP_SIZE = 50_000
+
+# Filename suffixes for attachment renditions (server previews are JPEGs)
+RENDITION_SUFFIXES = {
+    "original": "",
+    "preview": ".preview.jpg",
+    "thumbnail": ".thumb.jpg",
+}
+
+# Bytes read per chunk when streaming attachments to disk
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+
+# Seconds a metadata cache entry is used without asking the server again.
+# Channel lists carry last_post_at, so they are revalidated on every run.
+CACHE_TTLS = {
+    "user": 24 * 3600,
+    "team": 24 * 3600,
+    "channels": 0,
+}
+
+# Export file bytes per post assumed by the planner for channels it has no
+# export history for
+ESTIMATED_POST_BYTES = 600
+
+# Retries per request for throttled, failed or dropped requests
+MAX_RETRIES = 5
+
+# Exponential backoff bounds in seconds (the actual delay is jittered)
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+
+# Statuses worth retrying: rate limited, or a proxy/server hiccup
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Keep-alive connections held open to the server
+HTTP_POOL_SIZE = 32
+
+# Filename suffixes for --compress codecs
+COMPRESSION_SUFFIXES = {
+    "gzip": ".gz",
+    "zstd": ".zst",
+}
+
+# Compression levels: fast settings, chat text compresses well regardless
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+# Attachment types that are already compressed and are stored as-is
+PRECOMPRESSED_TYPES = [
+    "image/*", "video/*", "audio/*", "application/pdf", "application/zip",
+    "application/gzip", "application/x-gzip", "application/zstd", "application/x-xz",
+    "application/x-bzip2", "application/x-7z-compressed", "application/x-rar*",
+    "application/vnd.openxmlformats-officedocument.*", "application/vnd.oasis.opendocument.*",
+    "application/java-archive", "application/epub+zip",
+]
+PRECOMPRESSED_EXTENSIONS = {
+    "jpg", "jpeg", "png", "gif", "webp", "heic", "mp4", "mov", "mkv", "webm", "mp3",
+    "m4a", "ogg", "pdf", "zip", "gz", "tgz", "zst", "xz", "bz2", "7z", "rar", "jar",
+    "docx", "xlsx", "pptx", "odt", "ods", "epub",
+}
+
+# Driver exceptions for HTTP error statuses, as mattermostdriver raises them
+DRIVER_ERRORS = {
+    400: InvalidOrMissingParameters,
+    401: NoAccessTokenProvided,
+    403: NotEnoughPermissions,
+    404: ResourceNotFound,
+    405: MethodNotAllowed,
+    413: ContentTooLarge,
+    501: FeatureDisabled,
+}
+
+
+class ExportMetrics:
+    """Phase timers and counters for one export run (thread-safe).
+
+    Phases are timed wherever they run, so with parallel workers the
+    summed time of a phase can exceed the run's wall-clock time. Phases
+    nest: "transform" includes "code_extraction".
+    """
+
+    def __init__(self):
+        self.started_at = datetime.utcnow().isoformat() + "Z"
+        self.started = time.perf_counter()
+        self.phases: Dict[str, List[float]] = {}
+        self.counters: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def timer(self, phase: str) -> Iterator[None]:
+        """Time a block of work as one call of a phase."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                totals = self.phases.setdefault(phase, [0.0, 0])
+                totals[0] += elapsed
+                totals[1] += 1
+
+    def count(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def report(self) -> Dict:
+        """Snapshot of the timers and counters."""
+        with self._lock:
+            return {
+                "started_at": self.started_at,
+                "elapsed_seconds": round(time.perf_counter() - self.started, 3),
+                "phases": {
+                    phase: {"seconds": round(seconds, 3), "calls": calls}
+                    for phase, (seconds, calls) in sorted(self.phases.items())
+                },
+                "counters": dict(sorted(self.counters.items())),
+            }
+
+
+def merge_metrics(reports: List[Dict]) -> Dict:
+    """Combine metrics reports from several exporters (e.g. worker processes).
+
+    Numbers are summed, except elapsed time, which is the longest, and
+    the derived rates, which are recomputed.
+    """
+    def merge(into: Dict, report: Dict) -> None:
+        for key, value in report.items():
+            if isinstance(value, dict):
+                merge(into.setdefault(key, {}), value)
+            elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                into[key] = into.get(key, 0) + value
+            else:
+                into.setdefault(key, value)
+
+    merged: Dict = {}
+    for report in reports:
+        merge(merged, report)
+    if reports:
+        merged["started_at"] = min(report["started_at"] for report in reports)
+        merged["elapsed_seconds"] = max(report["elapsed_seconds"] for report in reports)
+        _add_metric_rates(merged)
+    return merged
+
+
+def _add_metric_rates(report: Dict) -> None:
+    """Fill in the derived figures of a metrics report."""
+    elapsed = max(report["elapsed_seconds"], 1e-6)
+    cache = report["cache"]
+    lookups = cache["hits"] + cache["stale"] + cache["misses"]
+    cache["hit_rate"] = round(cache["hits"] / lookups, 3) if lookups else None
+    report["posts_per_second"] = round(report["counters"].get("posts_exported", 0) / elapsed, 1)
+
+
+class SyncManifest:
+    """Per-channel sync state for incremental exports.
+
+    Stored as JSON in the export directory. For each channel it keeps the
+    newest post's create_at and id, the latest update_at seen and the
+    channel's export file, which is where the next incremental run resumes.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.channels: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+        if path.exists():
+            self.channels = json.loads(path.read_text(encoding="utf-8")).get("channels", {})
+
+    def get(self, channel_id: str) -> Optional[Dict]:
+        """Return the recorded state for a channel, if it was synced before."""
+        with self._lock:
+            return self.channels.get(channel_id)
+
+    @staticmethod
+    def new_state(previous: Optional[Dict] = None) -> Dict:
+        """Start a channel's sync state, continuing from a previous one."""
+        return {
+            "last_create_at": previous["last_create_at"] if previous else 0,
+            "last_update_at": previous["last_update_at"] if previous else 0,
+            "last_post_id": previous["last_post_id"] if previous else ""
+        }
+
+    @staticmethod
+    def advance(state: Dict, post: Dict) -> None:
+        """Move a sync state past a raw API post."""
+        if post["create_at"] > state["last_create_at"]:
+            state["last_create_at"] = post["create_at"]
+            state["last_post_id"] = post["id"]
+        state["last_update_at"] = max(state["last_update_at"],
+                                      post.get("update_at", post["create_at"]))
+
+    @staticmethod
+    def hold_back(state: Dict, before_ts: float) -> None:
+        """Keep a sync state from passing a --before bound (epoch seconds).
+
+        Posts after the bound were not exported, and an edit to an older
+        post can carry update_at past them, so the next sync asks for every
+        change since the bound and picks them up.
+        """
+        state["last_update_at"] = min(state["last_update_at"], int(before_ts * 1000))
+
+    def record(self, channel_id: str, state: Dict, export_file: Path) -> None:
+        """Save a channel's new sync state."""
+        with self._lock:
+            state = dict(state)
+            state["export_file"] = export_file.relative_to(self.path.parent).as_posix()
+            state["synced_at"] = datetime.utcnow().isoformat() + "Z"
+            self.channels[channel_id] = state
+
+            # Write atomically so an interrupted run never leaves a torn manifest
+            tmp_file = self.path.with_suffix(".tmp")
+            tmp_file.write_text(json.dumps({"channels": self.channels}, indent=2),
+                                encoding="utf-8")
+            tmp_file.replace(self.path)
+
+
+class ExportJournal:
+    """Append-only progress journal that lets an interrupted export resume.
+
+    Kept as JSON lines in the export directory. Each fetched page is logged
+    with the cursor to continue from and the size of the channel's page
+    spool at that point; finished channels are logged once their export
+    file and attachments are complete. A torn last line (from a crash
+    mid-write) is ignored on replay.
+    """
+
+    FILE_NAME = "export_journal.jsonl"
+
+    def __init__(self, output_dir: Path, resume: bool = False):
+        self.path = output_dir / self.FILE_NAME
+        self.meta: Dict = {}
+        self.channels: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+        if resume and self.path.exists():
+            self._replay()
+        self._file = open(self.path, "a" if resume else "w", encoding="utf-8")
+
+    def _replay(self) -> None:
+        with open(self.path, encoding="utf-8") as journal:
+            for line in journal:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break
+                event = entry.pop("event")
+                if event == "start":
+                    self.meta = entry
+                else:
+                    channel = self.channels.setdefault(entry.pop("channel"), {})
+                    channel.update(entry, status=event)
+
+    def _append(self, event: str, **fields) -> None:
+        with self._lock:
+            self._file.write(json.dumps(dict(event=event, **fields)) + "\n")
+            self._file.flush()
+
+    def start(self, **meta) -> None:
+        """Record the run's selections (teams, channels) for a later resume."""
+        self.meta = meta
+        self._append("start", **meta)
+
+    def is_done(self, channel_id: str) -> bool:
+        return self.channels.get(channel_id, {}).get("status") == "done"
+
+    def checkpoint(self, channel_id: str) -> Optional[Dict]:
+        """Where an unfinished channel's fetch stopped, if it got anywhere."""
+        channel = self.channels.get(channel_id)
+        if channel and channel["status"] in ("page", "fetched"):
+            return channel
+        return None
+
+    def page_fetched(self, channel_id: str, cursor: str, spool: "PageSpool") -> None:
+        spool.flush()
+        self._append("page", channel=channel_id, cursor=cursor,
+                     pages=spool.page_count, spool_size=spool.size)
+
+    def fetch_complete(self, channel_id: str, spool: "PageSpool") -> None:
+        spool.flush()
+        self._append("fetched", channel=channel_id, pages=spool.page_count,
+                     spool_size=spool.size)
+
+    def channel_done(self, channel_id: str, export_file: Path) -> None:
+        self.channels[channel_id] = {"status": "done"}
+        self._append("done", channel=channel_id,
+                     export_file=export_file.relative_to(self.path.parent).as_posix())
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class WorkspaceThreadIndex:
+    """Cross-channel index of exported threads (thread_index.sqlite).
+
+    One row per thread and export part (the shard key, or "" for unsharded
+    exports) with the channel, the export file holding its replies, the
+    reply count, first and last reply times, and whether the root post is
+    in that file. Rows for a channel are replaced when it is re-exported.
+    Totals for a thread spanning shards are the SUM/MAX over its rows.
+    """
+
+    FILE_NAME = "thread_index.sqlite"
+
+    def __init__(self, output_dir: Path):
+        self.output_dir = output_dir
+        # Channels exported in parallel threads or processes share the file
+        self._db = sqlite3.connect(str(output_dir / self.FILE_NAME), timeout=60)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS threads (root_id TEXT, channel_id TEXT, part TEXT, "
+            "export_file TEXT, reply_count INTEGER, first_reply_at TEXT, "
+            "last_reply_at TEXT, root_in_file INTEGER, PRIMARY KEY (root_id, channel_id, part))"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS threads_channel ON threads (channel_id)")
+        self._db.commit()
+
+    def replace_channel(self, channel_id: str, channel_dir: Path,
+                        parts: List[Tuple[str, str, List[Tuple]]],
+                        keep_parts: Iterable[str] = ()) -> None:
+        """Replace a channel's threads with the (part, file name, summary)
+        parts of its new export, keeping rows of the parts in keep_parts."""
+        keep_parts = list(keep_parts)
+        directory = channel_dir.relative_to(self.output_dir).as_posix()
+        with self._db:
+            self._db.execute(
+                "DELETE FROM threads WHERE channel_id = ? AND part NOT IN "
+                f"({', '.join('?' * len(keep_parts))})",
+                (channel_id, *keep_parts)
+            )
+            self._db.executemany(
+                "INSERT OR REPLACE INTO threads VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                ((root_id, channel_id, part, f"{directory}/{file_name}", count,
+                  first, last, has_root)
+                 for part, file_name, summary in parts
+                 for root_id, count, first, last, has_root in summary)
+            )
+
+    def close(self) -> None:
+        self._db.close()
+
+
+class SearchIndex:
+    """SQLite full-text search index over exported posts (--search-index).
+
+    Holds posts, users and channels tables, a threads view and an FTS5
+    index (posts_fts) over message text that triggers keep in step with
+    the posts table. Posts are written SEARCH_BATCH_SIZE per transaction
+    as they stream through an export, and the database is in WAL mode, so
+    channels exported in parallel threads or processes share one file.
+    Rows are keyed by post id, so one database can collect many runs.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS posts (
+            rowid INTEGER PRIMARY KEY, id TEXT UNIQUE, channel_id TEXT, idx INTEGER,
+            create_at INTEGER, created TEXT, username TEXT, root_id TEXT, message TEXT,
+            export_run TEXT
+        );
+        CREATE INDEX IF NOT EXISTS posts_channel ON posts (channel_id, create_at);
+        CREATE INDEX IF NOT EXISTS posts_user ON posts (username, create_at);
+        CREATE INDEX IF NOT EXISTS posts_root ON posts (root_id) WHERE root_id != '';
+        CREATE TABLE IF NOT EXISTS users (id TEXT PRIMARY KEY, username TEXT);
+        CREATE TABLE IF NOT EXISTS channels (
+            id TEXT PRIMARY KEY, name TEXT, display_name TEXT, type TEXT, team TEXT,
+            team_id TEXT, post_count INTEGER, exported_at TEXT, export_file TEXT
+        );
+        CREATE VIEW IF NOT EXISTS threads AS
+            SELECT root_id, channel_id, COUNT(*) AS reply_count,
+                   MIN(create_at) AS first_reply_at, MAX(create_at) AS last_reply_at
+            FROM posts WHERE root_id != '' GROUP BY root_id;
+        CREATE VIRTUAL TABLE IF NOT EXISTS posts_fts USING fts5(
+            message, content='posts', content_rowid='rowid'
+        );
+        CREATE TRIGGER IF NOT EXISTS posts_fts_insert AFTER INSERT ON posts BEGIN
+            INSERT INTO posts_fts (rowid, message) VALUES (new.rowid, new.message);
+        END;
+        CREATE TRIGGER IF NOT EXISTS posts_fts_delete AFTER DELETE ON posts BEGIN
+            INSERT INTO posts_fts (posts_fts, rowid, message)
+            VALUES ('delete', old.rowid, old.message);
+        END;
+        CREATE TRIGGER IF NOT EXISTS posts_fts_update AFTER UPDATE OF message ON posts
+        WHEN old.message IS NOT new.message BEGIN
+            INSERT INTO posts_fts (posts_fts, rowid, message)
+            VALUES ('delete', old.rowid, old.message);
+            INSERT INTO posts_fts (rowid, message) VALUES (new.rowid, new.message);
+        END;
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._db = sqlite3.connect(str(path), timeout=60)
+        self._db.execute("PRAGMA journal_mode = WAL")
+        try:
+            self._db.executescript(self.SCHEMA)
+        except sqlite3.OperationalError as e:
+            self._db.close()
+            raise RuntimeError(f"Can't create search index (SQLite without FTS5?): {e}")
+        self._run = uuid.uuid4().hex
+        self._pending: List[Tuple] = []
+
+    def add(self, channel_id: str, post_data: Dict) -> None:
+        """Queue an exported post; queued posts are written in batches."""
+        self._pending.append((
+            post_data["id"], channel_id, post_data["idx"],
+            int(_parse_created(post_data["created"]).replace(tzinfo=timezone.utc)
+                .timestamp() * 1000),
+            post_data["created"], post_data["username"], post_data.get("root_id", ""),
+            post_data["message"], self._run
+        ))
+        if len(self._pending) >= SEARCH_BATCH_SIZE:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self._pending:
+            return
+        with self._db:
+            self._db.executemany(
+                "INSERT INTO posts (id, channel_id, idx, create_at, created, username, "
+                "root_id, message, export_run) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (id) DO UPDATE SET channel_id = excluded.channel_id, "
+                "idx = excluded.idx, create_at = excluded.create_at, "
+                "created = excluded.created, username = excluded.username, "
+                "root_id = excluded.root_id, message = excluded.message, "
+                "export_run = excluded.export_run",
+                self._pending
+            )
+        self._pending = []
+
+    def finish_channel(self, channel_info: Dict, export_file: Path, full: bool,
+                       deleted_ids: Iterable[str], users: Dict[str, str],
+                       after_ts: Optional[float] = None,
+                       before_ts: Optional[float] = None) -> None:
+        """Record a finished channel export and drop posts it no longer has:
+        after a full export, every post of the channel in its --after/--before
+        window (epoch seconds) that it didn't write; after an incremental one,
+        the posts deleted since. Posts outside the window, indexed by other
+        runs, are kept."""
+        self.flush()
+        with self._db:
+            if full:
+                clauses = ["channel_id = ?", "export_run != ?"]
+                params = [channel_info["id"], self._run]
+                if after_ts:
+                    clauses.append("create_at >= ?")
+                    params.append(after_ts * 1000)
+                if before_ts:
+                    clauses.append("create_at <= ?")
+                    params.append(before_ts * 1000)
+                self._db.execute("DELETE FROM posts WHERE " + " AND ".join(clauses), params)
+            self._db.executemany("DELETE FROM posts WHERE id = ?",
+                                 ((post_id,) for post_id in deleted_ids))
+            self._db.execute(
+                "INSERT OR REPLACE INTO channels VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (channel_info["id"], channel_info["name"], channel_info["display_name"],
+                 channel_info["type"], channel_info["team"], channel_info["team_id"],
+                 channel_info["post_count"], channel_info["exported_at"],
+                 str(export_file.resolve()))
+            )
+            self._db.executemany("INSERT OR REPLACE INTO users VALUES (?, ?)", users.items())
+
+    def search(self, text: Optional[str] = None, username: Optional[str] = None,
+               channel: Optional[str] = None, after: Optional[datetime] = None,
+               before: Optional[datetime] = None, limit: int = 50) -> List[Dict]:
+        """Find posts, newest first. `text` is an FTS5 query (words, "phrases",
+        prefix*, AND/OR/NOT); `channel` matches a channel id, name or display
+        name; after/before bound the creation time."""
+        clauses, params = [], []
+        if text:
+            clauses.append("p.rowid IN (SELECT rowid FROM posts_fts WHERE posts_fts MATCH ?)")
+            params.append(text)
+        if username:
+            clauses.append("p.username = ?")
+            params.append(username)
+        if channel:
+            clauses.append("(c.id = ? OR c.name = ? OR c.display_name = ?)")
+            params += [channel] * 3
+        if after:
+            clauses.append("p.create_at >= ?")
+            params.append(int(after.timestamp() * 1000))
+        if before:
+            clauses.append("p.create_at <= ?")
+            params.append(int(before.timestamp() * 1000))
+        rows = self._db.execute(
+            "SELECT p.id, p.channel_id, c.display_name, p.idx, p.created, p.username, "
+            "p.root_id, p.message FROM posts p LEFT JOIN channels c ON c.id = p.channel_id "
+            + ("WHERE " + " AND ".join(clauses) if clauses else "")
+            + " ORDER BY p.create_at DESC LIMIT ?",
+            (*params, limit)
+        )
+        columns = ["id", "channel_id", "channel", "idx", "created", "username", "root_id",
+                   "message"]
+        return [dict(zip(columns, row)) for row in rows]
+
+    def close(self) -> None:
+        self._db.close()
+
+
+class CacheEntry(NamedTuple):
+    """A metadata cache hit."""
+    data: object
+    etag: Optional[str]
+    fetched_at: float
+    fresh: bool
+
+
+class MetadataCache:
+    """Persistent SQLite cache of server metadata: users, teams, channel lists.
+
+    Shared by all exporter scripts and keyed by server host. Entries are
+    served without a request while younger than their TTL (CACHE_TTLS);
+    stale entries are revalidated with the server (ETag or `since`) rather
+    than downloaded again where the endpoint supports it.
+    """
+
+    def __init__(self, path: Path, host: str, ttls: Optional[Dict[str, float]] = None):
+        self.path = path
+        self.host = host
+        self.ttls = dict(CACHE_TTLS, **(ttls or {}))
+        self.hits = self.stale = self.misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(path), check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS metadata ("
+            " host TEXT, kind TEXT, key TEXT, data TEXT, etag TEXT, fetched_at REAL,"
+            " PRIMARY KEY (host, kind, key))"
+        )
+        self._db.commit()
+
+    def get(self, kind: str, key: str) -> Optional[CacheEntry]:
+        """Look up one entry."""
+        return self.get_many(kind, [key]).get(key)
+
+    def get_many(self, kind: str, keys: Iterable[str]) -> Dict[str, CacheEntry]:
+        """Look up several entries of one kind, returning the ones found."""
+        keys = list(keys)
+        now = time.time()
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                rows = self._db.execute(
+                    "SELECT key, data, etag, fetched_at FROM metadata "
+                    f"WHERE host = ? AND kind = ? AND key IN ({','.join('?' * len(chunk))})",
+                    [self.host, kind, *chunk]
+                )
+                for key, data, etag, fetched_at in rows:
+                    fresh = now - fetched_at < self.ttls.get(kind, 0)
+                    found[key] = CacheEntry(json.loads(data), etag, fetched_at, fresh)
+            fresh_count = sum(1 for entry in found.values() if entry.fresh)
+            self.hits += fresh_count
+            self.stale += len(found) - fresh_count
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put(self, kind: str, key: str, data, etag: Optional[str] = None) -> None:
+        """Store one entry."""
+        self.put_many(kind, {key: data}, etag)
+
+    def put_many(self, kind: str, items: Dict[str, object],
+                 etag: Optional[str] = None) -> None:
+        """Store several entries of one kind."""
+        now = time.time()
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?, ?, ?)",
+                [(self.host, kind, key, json.dumps(data), etag, now)
+                 for key, data in items.items()]
+            )
+            self._db.commit()
+
+    def touch(self, kind: str, keys: Iterable[str]) -> None:
+        """Mark entries as just revalidated."""
+        now = time.time()
+        with self._lock:
+            self._db.executemany(
+                "UPDATE metadata SET fetched_at = ? WHERE host = ? AND kind = ? AND key = ?",
+                [(now, self.host, kind, key) for key in keys]
+            )
+            self._db.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+class BlobStore:
+    """Content-addressed attachment store shared across channels and runs.
+
+    Files live once under objects/<sha256[:2]>/<sha256>, and index.sqlite
+    maps Mattermost file ids to their content hash. A file id already in
+    the store is never downloaded again, and a re-posted file with a new id
+    but identical content is stored only once. Channel exports reference
+    blobs through hard links (copies where the filesystem can't link).
+    """
+
+    def __init__(self, root: Path):
+        self.root = root
+        (root / "objects").mkdir(parents=True, exist_ok=True)
+        (root / "tmp").mkdir(exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(root / "index.sqlite"), check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS files (file_id TEXT PRIMARY KEY, sha256 TEXT, size INTEGER)"
+        )
+        self._db.commit()
+
+    def blob_path(self, sha256: str) -> Path:
+        return self.root / "objects" / sha256[:2] / sha256
+
+    def find(self, file_id: str) -> Optional[Path]:
+        """Return the stored blob for a file id, if we have it."""
+        with self._lock:
+            row = self._db.execute("SELECT sha256 FROM files WHERE file_id = ?",
+                                   (file_id,)).fetchone()
+        if row and self.blob_path(row[0]).exists():
+            return self.blob_path(row[0])
+        return None
+
+    def temp_path(self) -> Path:
+        """A scratch path inside the store (same filesystem as the blobs)."""
+        return self.root / "tmp" / f"{uuid.uuid4().hex}.part"
+
+    def add(self, file_id: str, temp_file: Path, sha256: str, size: int) -> Path:
+        """Move a downloaded file into the store and index it under file_id."""
+        blob = self.blob_path(sha256)
+        blob.parent.mkdir(exist_ok=True)
+        if blob.exists():
+            temp_file.unlink()
+        else:
+            temp_file.replace(blob)
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?)",
+                             (file_id, sha256, size))
+            self._db.commit()
+        return blob
+
+    @staticmethod
+    def link(blob: Path, path: Path) -> None:
+        """Place a blob at path in a channel export."""
+        try:
+            os.link(blob, path)
+        except FileExistsError:
+            pass
+        except OSError:
+            shutil.copyfile(blob, path)
+
+
+class CodeArchive:
+    """Packed, deduplicated store of a channel's code blocks.
+
+    Snippets are appended to one `<channel>.code` file, each distinct
+    snippet (by SHA-256) once; `<channel>.code_index.ndjson` lists every
+    snippet's hash, byte offset, byte length and language. Posts reference
+    their blocks by offset and length, so one read fetches a snippet.
+
+    A fresh archive is built under a scratch name and replaces the old one
+    on close(), leaving the previous export's references intact until then.
+    With append=True (incremental syncs) new snippets are appended to the
+    existing archive, whose offsets never move.
+    """
+
+    def __init__(self, path: Path, append: bool = False):
+        self.path = path
+        self.index_path = path.with_name(path.stem + ".code_index.ndjson")
+        self.snippets: Dict[str, Dict] = {}
+        self.added = 0
+        append = append and path.exists() and self.index_path.exists()
+        if append:
+            with open(self.index_path, encoding="utf-8") as index:
+                for line in index:
+                    entry = json.loads(line)
+                    self.snippets[entry["sha256"]] = entry
+        self._write_path = path if append else path.with_name(f".{path.name}.tmp")
+        self._file = None
+        self._append = append
+        self._offset = path.stat().st_size if append else 0
+
+    def add(self, language: str, code: str) -> Dict:
+        """Store a snippet (unless it's already stored) and return its reference."""
+        data = code.encode("utf-8")
+        sha256 = hashlib.sha256(data).hexdigest()
+        entry = self.snippets.get(sha256)
+        if entry is None:
+            if self._file is None:
+                self._file = open(self._write_path, "ab" if self._append else "wb")
+            self._file.write(data)
+            entry = self.snippets[sha256] = {
+                "sha256": sha256, "offset": self._offset, "length": len(data),
+                "language": language,
+            }
+            self._offset += len(data)
+            self.added += 1
+        return {"language": language, "offset": entry["offset"],
+                "length": entry["length"], "sha256": sha256}
+
+    def close(self) -> None:
+        """Finish the archive and write its index."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            if not self._append:
+                self._write_path.replace(self.path)
+        elif not self._append:
+            # Nothing extracted: drop what a previous export left behind
+            self.path.unlink(missing_ok=True)
+            self.index_path.unlink(missing_ok=True)
+            return
+        tmp_file = self.index_path.with_name(f".{self.index_path.name}.tmp")
+        with open(tmp_file, "w", encoding="utf-8") as index:
+            for entry in sorted(self.snippets.values(), key=lambda e: e["offset"]):
+                index.write(_dump_record(entry) + "\n")
+        tmp_file.replace(self.index_path)
+
+    def abort(self) -> None:
+        """Discard snippets of a failed export (appended bytes stay unreferenced)."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if not self._append:
+            self._write_path.unlink(missing_ok=True)
+
+
+def read_code_block(archive: Path, block: Dict) -> str:
+    """Read one code block referenced by an exported post from its archive."""
+    with open(archive, "rb") as f:
+        f.seek(block["offset"])
+        return f.read(block["length"]).decode("utf-8")
+
+
+class AttachmentFilter:
+    """Decides which attachments to download, and in which rendition.
+
+    Rules are evaluated against the file metadata the posts already carry
+    (size, MIME type), so rejected files cost no request at all. In
+    "preview" or "thumbnail" mode, files the server has a preview image
+    for are fetched as that small rendition instead of the original;
+    other files (videos, archives, ...) are skipped unless mime_allow names
+    their type, in which case the original is fetched. The deny list and
+    size limit apply whichever rendition is fetched.
+    """
+
+    def __init__(self, max_size: Optional[int] = None,
+                 mime_allow: Optional[List[str]] = None,
+                 mime_deny: Optional[List[str]] = None,
+                 mode: str = "original"):
+        self.max_size = max_size
+        self.mime_allow = mime_allow or []
+        self.mime_deny = mime_deny or []
+        self.mode = mode
+
+    def rendition(self, file_info: Dict) -> str:
+        """The rendition to fetch: "original", "preview" or "thumbnail"."""
+        if self.mode != "original" and file_info.get("has_preview_image"):
+            return self.mode
+        return "original"
+
+    def skip_reason(self, file_info: Dict) -> Optional[str]:
+        """Why an attachment should not be downloaded, or None to keep it."""
+        mime_type = file_info.get("mime_type", "").lower()
+        if self.rendition(file_info) == "original":
+            allowed = any(fnmatch(mime_type, p) for p in self.mime_allow)
+            if self.mode != "original" and not allowed:
+                return "no preview"
+            if self.mime_allow and not allowed:
+                return f"type {mime_type or 'unknown'} not allowed"
+        if any(fnmatch(mime_type, p) for p in self.mime_deny):
+            return f"type {mime_type} denied"
+        if self.max_size is not None and file_info.get("size", 0) > self.max_size:
+            return f"{_format_bytes(file_info['size'])} over size limit"
+        return None
+
+
+class DownloadBatch:
+    """The attachment downloads queued by one channel export."""
+
+    def __init__(self, downloader: "AttachmentDownloader",
+                 attachment_filter: Optional[AttachmentFilter] = None,
+                 compression: Optional[str] = None):
+        self.downloader = downloader
+        self.filter = attachment_filter or AttachmentFilter()
+        self.compression = compression
+        self.started = time.monotonic()
+        self._pending: List[Tuple[str, Future]] = []
+
+    def add(self, file_info: Dict, path: Path, rendition: str = "original",
+            compression: Optional[str] = None) -> None:
+        """Queue an attachment (or its preview rendition) for download to path."""
+        future = self.downloader.submit(file_info["id"], path, rendition, compression)
+        self._pending.append((file_info["name"], future))
+
+    def compression_for(self, file_info: Dict, rendition: str) -> Optional[str]:
+        """The codec to store an attachment with: the batch's --compress
+        codec, except for previews and already-compressed types."""
+        if rendition != "original" or _is_precompressed(file_info):
+            return None
+        return self.compression
+
+    def wait(self) -> Tuple[int, int, int, List[Tuple[str, str]], float]:
+        """Wait for the batch.
+
+        Returns (files saved, files reused from the blob store, bytes
+        downloaded, errors, elapsed seconds).
+        """
+        files = reused = size = 0
+        errors = []
+        for name, future in self._pending:
+            try:
+                downloaded, from_store = future.result()
+            except Exception as e:
+                errors.append((name, str(e)))
+                continue
+            files += 1
+            reused += from_store
+            size += downloaded
+        return files, reused, size, errors, time.monotonic() - self.started
+
+
+class AttachmentDownloader:
+    """Bounded pool that streams attachments straight to disk.
+
+    Downloads run in the background while posts keep being processed. Each
+    file is written in DOWNLOAD_CHUNK_SIZE chunks to a .part file that is
+    renamed when complete, so memory stays flat for large files and an
+    interrupted download is never mistaken for a finished one. With a
+    BlobStore, files it already holds are linked instead of downloaded.
+    Files can be compressed while they stream to disk; compressed blobs
+    are stored under the content hash plus the codec suffix.
+    """
+
+    def __init__(self, exporter: "MattermostExporter", workers: int = 4,
+                 blob_store: Optional[BlobStore] = None):
+        self.exporter = exporter
+        self.blob_store = blob_store
+        self.bytes_downloaded = 0
+        self.files_downloaded = 0
+        self.files_reused = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers),
+                                            thread_name_prefix="mm-download")
+
+    def batch(self, attachment_filter: Optional[AttachmentFilter] = None,
+              compression: Optional[str] = None) -> DownloadBatch:
+        """Start a batch of downloads for one channel."""
+        return DownloadBatch(self, attachment_filter, compression)
+
+    def submit(self, file_id: str, path: Path, rendition: str = "original",
+               compression: Optional[str] = None) -> Future:
+        """Queue a download.
+
+        The future resolves to (bytes downloaded, whether the file came
+        from the blob store).
+        """
+        return self._executor.submit(self._download, file_id, path, rendition, compression)
+
+    def _download(self, file_id: str, path: Path, rendition: str,
+                  compression: Optional[str]) -> Tuple[int, bool]:
+        endpoint = f"/files/{file_id}"
+        blob_key = file_id
+        if rendition != "original":
+            endpoint += f"/{rendition}"
+            blob_key += f"/{rendition}"
+        blob_suffix = COMPRESSION_SUFFIXES.get(compression, "")
+        blob_key += blob_suffix
+
+        store = self.blob_store
+        if store:
+            blob = store.find(blob_key)
+            if blob:
+                store.link(blob, path)
+                with self._lock:
+                    self.files_reused += 1
+                return 0, True
+
+        part_file = store.temp_path() if store else path.with_name(path.name + ".part")
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with self.exporter.metrics.timer("attachment_download"), \
+                    self.exporter._raw_get(endpoint, stream=True) as response:
+                response.raise_for_status()
+                with _open_compressed(part_file, "wb", compression) as f:
+                    for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                        f.write(chunk)
+                        digest.update(chunk)
+                        size += len(chunk)
+            if store:
+                blob = store.add(blob_key, part_file, digest.hexdigest() + blob_suffix, size)
+                store.link(blob, path)
+            else:
+                part_file.replace(path)
+        except BaseException:
+            part_file.unlink(missing_ok=True)
+            raise
+
+        with self._lock:
+            self.bytes_downloaded += size
+            self.files_downloaded += 1
+        return size, False
+
+    def close(self, cancel: bool = False) -> None:
+        """Shut the pool down, optionally dropping downloads not yet started."""
+        self._executor.shutdown(wait=not cancel, cancel_futures=cancel)
+
+
+class PageSpool:
+    """Append-only on-disk buffer of fetched post pages.
+
+    The API returns a channel newest first but exports are written oldest
+    first. Spooling each page to disk as it arrives and replaying the file
+    backwards keeps only one page in memory instead of the whole channel.
+    """
+
+    def __init__(self, path: Path, resume_size: Optional[int] = None):
+        self.path = path
+        self.post_count = 0
+        self._offsets: List[int] = []
+        if resume_size is None:
+            self._file = open(path, "w+b")
+        else:
+            # Reopen a checkpointed spool, dropping anything written after it
+            self._file = open(path, "r+b")
+            self._file.truncate(resume_size)
+            while self._file.tell() < resume_size:
+                self._offsets.append(self._file.tell())
+                self.post_count += len(json.loads(self._file.readline()))
+
+    @property
+    def page_count(self) -> int:
+        return len(self._offsets)
+
+    @property
+    def size(self) -> int:
+        return self._file.seek(0, os.SEEK_END)
+
+    def append(self, posts: List[Dict]) -> None:
+        """Add a page of raw posts (newest first, as returned by the API)."""
+        self._offsets.append(self._file.seek(0, os.SEEK_END))
+        self._file.write(json.dumps(posts, separators=(",", ":")).encode("utf-8") + b"\n")
+        self.post_count += len(posts)
+
+    def iter_pages(self) -> Iterator[List[Dict]]:
+        """Yield the spooled pages in the order they were fetched."""
+        self._file.flush()
+        for offset in self._offsets:
+            self._file.seek(offset)
+            yield json.loads(self._file.readline())
+
+    def flush(self) -> None:
+        self._file.flush()
+
+    def iter_oldest_first(self) -> Iterator[Dict]:
+        """Yield every spooled post in chronological order."""
+        self._file.flush()
+        for offset in reversed(self._offsets):
+            self._file.seek(offset)
+            yield from reversed(json.loads(self._file.readline()))
+
+    def close(self, keep: bool = False) -> None:
+        """Close the spool file, deleting it unless keep is set."""
+        self._file.close()
+        if not keep:
+            self.path.unlink(missing_ok=True)
+
+
+class ThreadIndex:
+    """Disk-backed index of thread replies, grouped by root post.
+
+    Replies are spooled into a scratch SQLite database while posts stream
+    past and read back one thread at a time, in the order each thread was
+    first seen and with replies sorted by creation time. Every post id is
+    recorded too, so roots missing from the export can be listed.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.reply_count = 0
+        self.thread_count = 0
+        self._db = sqlite3.connect(str(path))
+        self._db.execute("PRAGMA journal_mode = OFF")
+        self._db.execute("PRAGMA synchronous = OFF")
+        self._db.execute(
+            "CREATE TABLE replies (seq INTEGER PRIMARY KEY, root_id TEXT, created TEXT, data TEXT)"
+        )
+        self._db.execute("CREATE TABLE roots (root_id TEXT PRIMARY KEY, first_seq INTEGER)")
+        self._db.execute("CREATE TABLE posts (id TEXT PRIMARY KEY) WITHOUT ROWID")
+
+    def add(self, post_data: Dict) -> None:
+        """Record an exported post, filing replies under their root."""
+        self._db.execute("INSERT OR IGNORE INTO posts VALUES (?)", (post_data["id"],))
+        if not post_data.get("root_id"):
+            return
+        reply = {
+            "id": post_data["id"],
+            "idx": post_data["idx"],
+            "username": post_data["username"],
+            "created": post_data["created"],
+            "message": post_data["message"]
+        }
+        cursor = self._db.execute(
+            "INSERT INTO replies (root_id, created, data) VALUES (?, ?, ?)",
+            (post_data["root_id"], reply["created"], json.dumps(reply, ensure_ascii=False))
+        )
+        cursor = self._db.execute(
+            "INSERT OR IGNORE INTO roots (root_id, first_seq) VALUES (?, ?)",
+            (post_data["root_id"], cursor.lastrowid)
+        )
+        self.reply_count += 1
+        self.thread_count += cursor.rowcount
+
+    def missing_roots(self) -> List[str]:
+        """Roots of recorded replies that are not among the recorded posts."""
+        return [root_id for (root_id,) in self._db.execute(
+            "SELECT root_id FROM roots WHERE root_id NOT IN (SELECT id FROM posts) "
+            "ORDER BY first_seq"
+        )]
+
+    def summary(self) -> List[Tuple[str, int, str, str, bool]]:
+        """(root_id, reply count, first and last reply time, whether the root
+        was recorded) for every thread, in one pass over the replies."""
+        return [(root_id, count, first, last, bool(has_root)) for root_id, count, first, last,
+                has_root in self._db.execute(
+                    "SELECT r.root_id, COUNT(*), MIN(r.created), MAX(r.created), "
+                    "p.id IS NOT NULL FROM replies r LEFT JOIN posts p ON p.id = r.root_id "
+                    "GROUP BY r.root_id"
+                )]
+
+    def __iter__(self) -> Iterator[Tuple[str, List[Dict]]]:
+        """Yield (root_id, replies) pairs, one thread at a time."""
+        rows = self._db.execute(
+            "SELECT r.root_id, r.data FROM replies r JOIN roots t ON t.root_id = r.root_id "
+            "ORDER BY t.first_seq, r.created, r.seq"
+        )
+        for root_id, group in groupby(rows, key=lambda row: row[0]):
+            yield root_id, [json.loads(data) for _, data in group]
+
+    def close(self) -> None:
+        """Close and delete the scratch database."""
+        self._db.close()
+        self.path.unlink(missing_ok=True)
+
+
+def extract_code_blocks(message: str) -> List[Tuple[str, str]]:
+    """Every fenced code block in a message as (language, code), in one scan.
+
+    Fences pair up left to right. A word right after an opening fence on
+    its own line is the block's language tag. Blank blocks are skipped and
+    an unclosed fence ends the scan.
+    """
+    blocks = []
+    start = message.find("```")
+    while start != -1:
+        end = message.find("```", start + 3)
+        if end == -1:
+            break
+        body = message[start + 3:end]
+        language = ""
+        first_line, newline, rest = body.partition("\n")
+        tag = first_line.strip()
+        if newline and tag and " " not in tag:
+            language, body = tag, rest
+        code = body.strip()
+        if code:
+            blocks.append((language, code))
+        start = message.find("```", end + 3)
+    return blocks
+
+
+def _in_window(post: Dict, after_ts: Optional[float], before_ts: Optional[float]) -> bool:
+    """Check a raw post against the --after/--before bounds (epoch seconds)."""
+    created_ts = post["create_at"] / 1000
+    return not ((before_ts and created_ts > before_ts) or (after_ts and created_ts < after_ts))
+
+
+def _format_bytes(size: float) -> str:
+    """Human-readable byte count."""
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size:.1f} {unit}" if unit != "B" else f"{int(size)} B"
+        size /= 1024
+
+
+class ChannelPlan(NamedTuple):
+    """The planner's estimate for one channel."""
+    channel: Dict
+    posts: int
+    requests: int
+    size: int
+    skip: bool
+    export_file: Optional[str] = None  # where the previous export was written
+
+
+def _open_compressed(path: Path, mode: str, compression: Optional[str]) -> IO:
+    """Open path for streaming reads or writes through a --compress codec.
+
+    Text modes ("r", "w") use UTF-8; binary modes ("rb", "wb") pass bytes
+    through. With no compression this is a plain open().
+    """
+    text = "b" not in mode
+    if compression is None:
+        return open(path, mode, encoding="utf-8") if text else open(path, mode)
+
+    binary_mode = mode[0] + "b"
+    if compression == "gzip":
+        stream = gzip.GzipFile(path, binary_mode, compresslevel=GZIP_LEVEL, mtime=0)
+    elif compression == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstd compression needs the zstandard package: "
+                               "pip install zstandard")
+        raw = open(path, binary_mode)
+        if binary_mode == "wb":
+            stream = zstandard.ZstdCompressor(level=ZSTD_LEVEL).stream_writer(raw)
+        else:
+            stream = zstandard.ZstdDecompressor().stream_reader(raw)
+    else:
+        raise ValueError(f"Unknown compression: {compression}")
+    return io.TextIOWrapper(stream, encoding="utf-8") if text else stream
+
+
+def _split_compression(path: Path) -> Tuple[Path, Optional[str]]:
+    """Split a compression suffix off path: ("x.ndjson.gz") -> ("x.ndjson", "gzip")."""
+    for compression, suffix in COMPRESSION_SUFFIXES.items():
+        if path.name.endswith(suffix):
+            return path.with_name(path.name[:-len(suffix)]), compression
+    return path, None
+
+
+def open_export(export_file: Path) -> IO[str]:
+    """Open an exported file for reading as text, decompressing it if its
+    name ends in a --compress suffix (.gz, .zst)."""
+    return _open_compressed(export_file, "r", _split_compression(export_file)[1])
+
+
+def _is_precompressed(file_info: Dict) -> bool:
+    """Whether an attachment is already compressed (images, archives, video...)."""
+    mime_type = file_info.get("mime_type", "").lower()
+    extension = file_info.get("extension", "").lower().lstrip(".")
+    return (extension in PRECOMPRESSED_EXTENSIONS
+            or any(fnmatch(mime_type, p) for p in PRECOMPRESSED_TYPES))
+
+
+def _dump_record(obj) -> str:
+    """Serialize one NDJSON record (compact, like cards-export.ndjson)."""
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False)
+
+
+def _dump_nested(obj, indent: int) -> str:
+    """json.dumps(obj, indent=2) as it appears nested `indent` spaces deep."""
+    return json.dumps(obj, indent=2, ensure_ascii=False).replace("\n", "\n" + " " * indent)
+
+
+def _resolve_thread_roots(threads: ThreadIndex,
+                          resolve_roots: Optional[Callable[[List[str]], Dict[str, Dict]]]
+                          ) -> Dict[str, Dict]:
+    """Look up the roots of threads whose root post isn't in the export."""
+    if resolve_roots is None:
+        return {}
+    missing = threads.missing_roots()
+    return resolve_roots(missing) if missing else {}
+
+
+class ChannelJSONWriter:
+    """Streams a channel export into its JSON document.
+
+    Posts are appended to a part file as they arrive and thread replies go
+    to a ThreadIndex, so memory use doesn't grow with the channel. close()
+    assembles the final document, laid out exactly as
+    json.dumps(export_data, indent=2) would, and moves it into place
+    (compressed on the way out with a --compress codec).
+    """
+
+    suffix = ".json"
+
+    def __init__(self, json_file: Path, compression: Optional[str] = None,
+                 resolve_roots: Optional[Callable[[List[str]], Dict[str, Dict]]] = None):
+        self.json_file = json_file
+        self.compression = compression
+        self.resolve_roots = resolve_roots
+        self.thread_parts = []
+        self.post_count = 0
+        self.threads = ThreadIndex(self._scratch_path("threads"))
+        self._posts_path = self._scratch_path("posts")
+        self._posts = open(self._posts_path, "w", encoding="utf-8")
+
+    def _scratch_path(self, kind: str) -> Path:
+        return self.json_file.with_name(f".{self.json_file.name}.{kind}.tmp")
+
+    def write_post(self, post_data: Dict) -> None:
+        """Append one exported post."""
+        if self.post_count:
+            self._posts.write(",\n")
+        self._posts.write("    " + _dump_nested(post_data, 4))
+        self.post_count += 1
+        self.threads.add(post_data)
+
+    def close(self, channel_info: Dict) -> Dict:
+        """Write the finished document and return the completed channel info."""
+        channel_info = dict(channel_info,
+                            post_count=self.post_count,
+                            thread_count=self.threads.reply_count)
+        self._posts.close()
+        thread_roots = _resolve_thread_roots(self.threads, self.resolve_roots)
+        self.thread_parts = [("", self.json_file.name, self.threads.summary())]
+
+        tmp_file = self._scratch_path("json")
+        with _open_compressed(tmp_file, "w", self.compression) as out:
+            out.write('{\n  "channel": ' + _dump_nested(channel_info, 2) + ",\n")
+            if self.post_count:
+                out.write('  "posts": [\n')
+                with open(self._posts_path, encoding="utf-8") as posts:
+                    shutil.copyfileobj(posts, out)
+                out.write("\n  ],\n")
+            else:
+                out.write('  "posts": [],\n')
+
+            if thread_roots:
+                out.write('  "thread_roots": {\n')
+                out.write(",\n".join(f"    {json.dumps(root_id)}: " + _dump_nested(root, 4)
+                                      for root_id, root in thread_roots.items()))
+                out.write("\n  },\n")
+
+            if self.threads.thread_count:
+                out.write('  "threads": {\n')
+                for n, (root_id, replies) in enumerate(self.threads):
+                    if n:
+                        out.write(",\n")
+                    out.write(f"    {json.dumps(root_id)}: [\n")
+                    out.write(",\n".join("      " + _dump_nested(reply, 6) for reply in replies))
+                    out.write("\n    ]")
+                out.write("\n  }\n}")
+            else:
+                out.write('  "threads": {}\n}')
+        tmp_file.replace(self.json_file)
+
+        self.abort()
+        return channel_info
+
+    def abort(self) -> None:
+        """Discard scratch files, leaving any previous export untouched."""
+        self._posts.close()
+        self._posts_path.unlink(missing_ok=True)
+        self.threads.close()
+
+
+class ChannelNDJSONWriter:
+    """Streams a channel export as newline-delimited JSON.
+
+    Posts are appended to `<channel>.ndjson`, one compact record per line,
+    as they arrive. The channel header and the thread index (one record per
+    thread) are written at close to `<channel>.channel.json` and
+    `<channel>.threads.ndjson`. When replacing an existing export, posts go
+    to a scratch file first so the old export stays readable until then.
+    With a --compress codec the post and thread streams are compressed as
+    they are written; the small channel header stays plain JSON. Thread
+    roots fetched from outside the export are included in their thread's
+    record.
+    """
+
+    suffix = ".ndjson"
+
+    def __init__(self, ndjson_file: Path, compression: Optional[str] = None,
+                 resolve_roots: Optional[Callable[[List[str]], Dict[str, Dict]]] = None):
+        self.ndjson_file = ndjson_file
+        self.compression = compression
+        self.resolve_roots = resolve_roots
+        self.thread_parts = []
+        self.post_count = 0
+        self.threads = ThreadIndex(self._scratch_path("threads"))
+        self._posts_path = (self._scratch_path("posts") if ndjson_file.exists()
+                            else ndjson_file)
+        self._posts = _open_compressed(self._posts_path, "w", compression)
+
+    def _scratch_path(self, kind: str) -> Path:
+        return self.ndjson_file.with_name(f".{self.ndjson_file.name}.{kind}.tmp")
+
+    def _sidecar_path(self, suffix: str) -> Path:
+        plain_file = _split_compression(self.ndjson_file)[0]
+        return plain_file.with_name(plain_file.stem + suffix)
+
+    def write_post(self, post_data: Dict) -> None:
+        """Append one exported post."""
+        self._posts.write(_dump_record(post_data) + "\n")
+        self.post_count += 1
+        self.threads.add(post_data)
+
+    def close(self, channel_info: Dict) -> Dict:
+        """Finish the post stream, write the sidecars and return the channel info."""
+        channel_info = dict(channel_info,
+                            post_count=self.post_count,
+                            thread_count=self.threads.reply_count)
+        self._posts.close()
+        if self._posts_path != self.ndjson_file:
+            self._posts_path.replace(self.ndjson_file)
+        thread_roots = _resolve_thread_roots(self.threads, self.resolve_roots)
+        self.thread_parts = [("", self.ndjson_file.name, self.threads.summary())]
+
+        threads_file = self._sidecar_path(".threads.ndjson"
+                                          + COMPRESSION_SUFFIXES.get(self.compression, ""))
+        tmp_file = self._scratch_path("threads.ndjson")
+        with _open_compressed(tmp_file, "w", self.compression) as out:
+            for root_id, replies in self.threads:
+                record = {"root_id": root_id}
+                if root_id in thread_roots:
+                    record["root"] = thread_roots[root_id]
+                record["replies"] = replies
+                out.write(_dump_record(record) + "\n")
+        tmp_file.replace(threads_file)
+
+        self._sidecar_path(".channel.json").write_text(
+            json.dumps(channel_info, indent=2, ensure_ascii=False),
+            encoding="utf-8"
+        )
+
+        self.abort()
+        return channel_info
+
+    def abort(self) -> None:
+        """Discard scratch files, leaving any previous export untouched."""
+        self._posts.close()
+        if self._posts_path != self.ndjson_file:
+            self._posts_path.unlink(missing_ok=True)
+        self.threads.close()
+
+
+class ChannelParquetWriter:
+    """Streams a channel export into Parquet files for analytics.
+
+    `<channel>.parquet` holds one row per post with typed columns: UTC
+    millisecond timestamps, dictionary-encoded channel id and username, and
+    list columns for attachments and code blocks. Post rows, and one row
+    per attachment (with its size and MIME type) for
+    `<channel>.files.parquet`, are buffered and written
+    PARQUET_ROW_GROUP_SIZE at a time as row groups, so memory is bounded by
+    a row group. close() adds `<channel>.threads.parquet` (reply count,
+    first and last reply time, and the root if it was fetched from outside
+    the export) and the `<channel>.channel.json` header.
+
+    Parquet compresses internally: --compress picks its codec (snappy by
+    default) instead of wrapping the files.
+    """
+
+    suffix = ".parquet"
+    native_compression = True
+
+    def __init__(self, parquet_file: Path, compression: Optional[str] = None,
+                 resolve_roots: Optional[Callable[[List[str]], Dict[str, Dict]]] = None,
+                 channel_id: str = ""):
+        if pa is None:
+            raise RuntimeError("Parquet output needs pyarrow: pip install pyarrow")
+        self.parquet_file = parquet_file
+        self.codec = compression or "snappy"
+        self.resolve_roots = resolve_roots
+        self.channel_id = channel_id
+        self.thread_parts = []
+        self.post_count = 0
+        self.threads = ThreadIndex(self._scratch_path("threads"))
+        self._post_schema = self.post_schema()
+        self._post_fields = self._post_schema.names
+        self._file_schema = self.file_schema()
+        self._posts = pq.ParquetWriter(str(self._scratch_path("posts")),
+                                       self._post_schema, compression=self.codec)
+        self._files = pq.ParquetWriter(str(self._scratch_path("files")),
+                                       self._file_schema, compression=self.codec)
+        self._post_rows: List[Dict] = []
+        self._file_rows: List[Dict] = []
+
+    @staticmethod
+    def post_schema() -> "pa.Schema":
+        names = pa.dictionary(pa.int32(), pa.string())
+        return pa.schema([
+            ("channel_id", names),
+            ("idx", pa.int64()),
+            ("id", pa.string()),
+            ("created", pa.timestamp("ms", tz="UTC")),
+            ("username", names),
+            ("message", pa.string()),
+            ("root_id", pa.string()),
+            ("is_reply", pa.bool_()),
+            ("code_blocks", pa.list_(pa.struct([
+                ("language", pa.string()), ("offset", pa.int64()),
+                ("length", pa.int64()), ("sha256", pa.string()),
+            ]))),
+            ("files", pa.list_(pa.string())),
+            ("files_meta", pa.list_(pa.struct([
+                ("name", pa.string()), ("size", pa.int64()), ("mime_type", pa.string()),
+            ]))),
+            ("files_skipped", pa.list_(pa.struct([
+                ("name", pa.string()), ("reason", pa.string()),
+            ]))),
+        ])
+
+    @staticmethod
+    def file_schema() -> "pa.Schema":
+        names = pa.dictionary(pa.int32(), pa.string())
+        return pa.schema([
+            ("channel_id", names),
+            ("post_id", pa.string()),
+            ("idx", pa.int64()),
+            ("created", pa.timestamp("ms", tz="UTC")),
+            ("username", names),
+            ("name", pa.string()),
+            ("extension", names),
+            ("size", pa.int64()),
+            ("mime_type", names),
+            ("skip_reason", pa.string()),
+        ])
+
+    @staticmethod
+    def thread_schema() -> "pa.Schema":
+        return pa.schema([
+            ("channel_id", pa.dictionary(pa.int32(), pa.string())),
+            ("root_id", pa.string()),
+            ("reply_count", pa.int64()),
+            ("first_reply_at", pa.timestamp("ms", tz="UTC")),
+            ("last_reply_at", pa.timestamp("ms", tz="UTC")),
+            ("root_in_export", pa.bool_()),
+            ("root_created", pa.timestamp("ms", tz="UTC")),
+            ("root_username", pa.string()),
+            ("root_message", pa.string()),
+        ])
+
+    def _scratch_path(self, kind: str) -> Path:
+        return self.parquet_file.with_name(f".{self.parquet_file.name}.{kind}.tmp")
+
+    def _sidecar_path(self, suffix: str) -> Path:
+        return self.parquet_file.with_name(self.parquet_file.stem + suffix)
+
+    def write_post(self, post_data: Dict) -> None:
+        """Append one exported post."""
+        created = _parse_created(post_data["created"])
+        row = {field: post_data.get(field) for field in self._post_fields}
+        row.update(channel_id=self.channel_id, created=created)
+        self._post_rows.append(row)
+        skipped = {file["name"]: file["reason"] for file in post_data.get("files_skipped", [])}
+        # Exports written before files_meta was recorded only have the names
+        files_meta = (post_data.get("files_meta")
+                      or [{"name": name} for name in post_data.get("files", [])])
+        for file in files_meta:
+            self._file_rows.append({
+                "channel_id": self.channel_id, "post_id": post_data["id"],
+                "idx": post_data["idx"], "created": created,
+                "username": post_data["username"], "name": file["name"],
+                "extension": Path(file["name"]).suffix.lstrip(".").lower(),
+                "size": file.get("size"), "mime_type": file.get("mime_type"),
+                "skip_reason": skipped.get(file["name"]),
+            })
+        self.post_count += 1
+        self.threads.add(post_data)
+        if len(self._post_rows) >= PARQUET_ROW_GROUP_SIZE:
+            self._flush_posts()
+        if len(self._file_rows) >= PARQUET_ROW_GROUP_SIZE:
+            self._flush_files()
+
+    def _flush_posts(self) -> None:
+        if self._post_rows:
+            self._posts.write_table(pa.Table.from_pylist(self._post_rows, self._post_schema))
+            self._post_rows = []
+
+    def _flush_files(self) -> None:
+        if self._file_rows:
+            self._files.write_table(pa.Table.from_pylist(self._file_rows, self._file_schema))
+            self._file_rows = []
+
+    def close(self, channel_info: Dict) -> Dict:
+        """Finish the Parquet files, write the sidecars and return the channel info."""
+        channel_info = dict(channel_info,
+                            post_count=self.post_count,
+                            thread_count=self.threads.reply_count)
+        self._flush_posts()
+        self._flush_files()
+        self._posts.close()
+        self._files.close()
+
+        thread_roots = _resolve_thread_roots(self.threads, self.resolve_roots)
+        summary = self.threads.summary()
+        self.thread_parts = [("", self.parquet_file.name, summary)]
+        thread_rows = []
+        for root_id, count, first, last, has_root in summary:
+            root = thread_roots.get(root_id, {})
+            thread_rows.append({
+                "channel_id": self.channel_id, "root_id": root_id, "reply_count": count,
+                "first_reply_at": _parse_created(first), "last_reply_at": _parse_created(last),
+                "root_in_export": has_root,
+                "root_created": _parse_created(root["created"]) if root else None,
+                "root_username": root.get("username"), "root_message": root.get("message"),
+            })
+        tmp_file = self._scratch_path("threads.parquet")
+        pq.write_table(pa.Table.from_pylist(thread_rows, self.thread_schema()), str(tmp_file),
+                       compression=self.codec, row_group_size=PARQUET_ROW_GROUP_SIZE)
+
+        self._scratch_path("posts").replace(self.parquet_file)
+        self._scratch_path("files").replace(self._sidecar_path(".files.parquet"))
+        tmp_file.replace(self._sidecar_path(".threads.parquet"))
+        self._sidecar_path(".channel.json").write_text(
+            json.dumps(channel_info, indent=2, ensure_ascii=False),
+            encoding="utf-8"
+        )
+
+        self.abort()
+        return channel_info
+
+    def abort(self) -> None:
+        """Discard scratch files, leaving any previous export untouched."""
+        for writer in (self._posts, self._files):
+            if writer.is_open:
+                writer.close()
+        for kind in ("posts", "files", "threads.parquet"):
+            self._scratch_path(kind).unlink(missing_ok=True)
+        self.threads.close()
+
+
+def _iter_parquet_posts(parquet_file: Path) -> Iterator[Dict]:
+    """Read posts back from a Parquet channel export in the export format."""
+    for batch in pq.ParquetFile(str(parquet_file)).iter_batches(PARQUET_ROW_GROUP_SIZE):
+        for row in batch.to_pylist():
+            del row["channel_id"]
+            row["created"] = row["created"].replace(tzinfo=None).isoformat() + "Z"
+            yield {field: value for field, value in row.items() if value is not None}
+
+
+# Channel writers by --format name
+CHANNEL_WRITERS = {
+    "json": ChannelJSONWriter,
+    "ndjson": ChannelNDJSONWriter,
+    "parquet": ChannelParquetWriter,
+}
+
+
+def _export_file_name(base_name: str, writer_cls, compression: Optional[str]) -> str:
+    """A channel export's file name: format suffix, then the compression
+    suffix unless the format compresses internally."""
+    if getattr(writer_cls, "native_compression", False):
+        return base_name + writer_cls.suffix
+    return base_name + writer_cls.suffix + COMPRESSION_SUFFIXES.get(compression, "")
+
+
+def _open_channel_writer(writer_cls, path: Path, compression: Optional[str],
+                         resolve_roots: Optional[Callable[[List[str]], Dict[str, Dict]]],
+                         channel_id: str):
+    """Create a CHANNEL_WRITERS writer (the Parquet one also stores the
+    channel id in every row)."""
+    if writer_cls is ChannelParquetWriter:
+        return writer_cls(path, compression, resolve_roots, channel_id=channel_id)
+    return writer_cls(path, compression, resolve_roots)
+
+
+class ThreadTotals(NamedTuple):
+    """Reply and thread counts summed over a sharded export's shards."""
+    reply_count: int
+    thread_count: int
+
+
+def _parse_created(created: str) -> datetime:
+    """Parse an exported "created" timestamp back into a datetime."""
+    return datetime.fromisoformat(created.rstrip("Z"))
+
+
+class ShardedChannelWriter:
+    """Streams a channel export into time-partitioned shards.
+
+    Each post goes to the shard for its partition key: the month it was
+    created in ("2024-05") with partition="month", or idx // N ("00003")
+    with an integer partition of N posts. Shards are written by the
+    format's own writer as `<channel>.<key>.json` (or .ndjson), each with
+    the channel header plus its shard key. Posts arrive in order, so only
+    one shard is open at a time.
+
+    Each shard is self-contained: thread roots in other shards are
+    included like roots from outside the export.
+
+    Shards are built in a scratch directory and moved into place by close(),
+    which then writes `<channel>.index.json` listing every shard's file,
+    time range, idx range and counts, and removes shards of the previous
+    export that no longer exist. Shards passed to keep() are carried over
+    from the previous index untouched; incremental syncs use this to
+    rewrite only the shards that changed.
+    """
+
+    suffix = ".index.json"
+
+    def __init__(self, index_file: Path, writer_cls, partition: Union[str, int],
+                 compression: Optional[str], header: Dict,
+                 resolve_roots: Optional[Callable[[List[str]], Dict[str, Dict]]] = None):
+        self.index_file = index_file
+        self.writer_cls = writer_cls
+        self.partition = partition
+        self.compression = compression
+        self.header = header
+        self.resolve_roots = resolve_roots
+        self.thread_parts = []
+        self.base_name = index_file.name[:-len(self.suffix)]
+        self._scratch_dir = index_file.with_name(f".{index_file.name}.shards.tmp")
+        shutil.rmtree(self._scratch_dir, ignore_errors=True)
+        self._scratch_dir.mkdir()
+        self._shards: Dict[str, Dict] = {}
+        self._kept = set()
+        self._key = None
+        self._writer = None
+
+    @staticmethod
+    def load_index(index_file: Path) -> Dict:
+        return json.loads(index_file.read_text(encoding="utf-8"))
+
+    def shard_key(self, post_data: Dict) -> str:
+        if self.partition == "month":
+            return post_data["created"][:7]
+        return f"{post_data['idx'] // self.partition:05d}"
+
+    def keep(self, shards: List[Dict]) -> None:
+        """Carry shards of the previous index over without rewriting them."""
+        for shard in shards:
+            self._shards[shard["shard"]] = shard
+            self._kept.add(shard["shard"])
+
+    @property
+    def threads(self) -> ThreadTotals:
+        return ThreadTotals(sum(shard["thread_count"] for shard in self._shards.values()),
+                            sum(shard["root_count"] for shard in self._shards.values()))
+
+    def write_post(self, post_data: Dict) -> None:
+        """Append one exported post to its shard."""
+        key = self.shard_key(post_data)
+        if key != self._key:
+            self._finish_shard()
+            if key in self._shards:
+                raise ValueError(f"Post {post_data['id']} is out of order for shard {key}")
+            file_name = _export_file_name(f"{self.base_name}.{key}", self.writer_cls,
+                                          self.compression)
+            self._key = key
+            self._writer = _open_channel_writer(self.writer_cls, self._scratch_dir / file_name,
+                                                self.compression, self.resolve_roots,
+                                                self.header["id"])
+            self._shards[key] = {
+                "shard": key,
+                "file": file_name,
+                "first_created": post_data["created"],
+                "first_idx": post_data["idx"],
+            }
+        self._writer.write_post(post_data)
+        self._shards[key].update(last_created=post_data["created"],
+                                 last_idx=post_data["idx"])
+
+    def _finish_shard(self) -> None:
+        if self._writer is None:
+            return
+        shard_info = self._writer.close(dict(
+            self.header,
+            shard=self._key,
+            exported_at=datetime.utcnow().isoformat() + "Z"
+        ))
+        self._shards[self._key].update(post_count=shard_info["post_count"],
+                                       thread_count=shard_info["thread_count"],
+                                       root_count=self._writer.threads.thread_count)
+        self.thread_parts += [(self._key, file_name, summary)
+                              for _, file_name, summary in self._writer.thread_parts]
+        self._writer = None
+
+    def close(self, channel_info: Dict) -> Dict:
+        """Move the new shards into place, write the index and return the
+        completed channel info."""
+        self._finish_shard()
+        shards = [self._shards[key] for key in sorted(self._shards)]
+        channel_info = dict(channel_info,
+                            post_count=sum(shard["post_count"] for shard in shards),
+                            thread_count=self.threads.reply_count)
+
+        previous = (self.load_index(self.index_file)["shards"]
+                    if self.index_file.exists() else [])
+        for path in self._scratch_dir.iterdir():
+            path.replace(self.index_file.with_name(path.name))
+
+        tmp_file = self._scratch_dir / self.index_file.name
+        tmp_file.write_text(json.dumps({
+            "channel": channel_info,
+            "partition": self.partition,
+            "shards": shards,
+        }, indent=2, ensure_ascii=False), encoding="utf-8")
+        tmp_file.replace(self.index_file)
+
+        # Drop shards (and their sidecars) the new index no longer lists
+        for shard in previous:
+            if shard["shard"] not in self._shards:
+                prefix = f"{self.base_name}.{shard['shard']}."
+                for path in self.index_file.parent.iterdir():
+                    if path.name.startswith(prefix):
+                        path.unlink()
+
+        self.abort()
+        return channel_info
+
+    def abort(self) -> None:
+        """Discard unfinished shards, leaving any previous export untouched."""
+        if self._writer is not None:
+            self._writer.abort()
+            self._writer = None
+        shutil.rmtree(self._scratch_dir, ignore_errors=True)
+
+
+def _split_shards(shards: List[Dict], changes: List[Dict]) -> Tuple[List[Dict], List[Dict]]:
+    """Split an index's shards into (untouched, to rewrite) for a set of changes.
+
+    A changed post belongs to the shard(s) whose time range covers it; posts
+    newer than every shard go to the last shard, which they may extend.
+    """
+    touched = set()
+    for post in changes:
+        created = datetime.utcfromtimestamp(post["create_at"] / 1000)
+        covering = [shard["shard"] for shard in shards
+                    if _parse_created(shard["first_created"]) <= created
+                    <= _parse_created(shard["last_created"])]
+        if not covering and shards and created > _parse_created(shards[-1]["last_created"]):
+            covering = [shards[-1]["shard"]]
+        touched.update(covering)
+    return ([shard for shard in shards if shard["shard"] not in touched],
+            [shard for shard in shards if shard["shard"] in touched])
+
+
+def export_size(export_file: Path) -> int:
+    """Bytes on disk of a channel export, every shard included for a sharded one."""
+    size = export_file.stat().st_size
+    if export_file.name.endswith(ShardedChannelWriter.suffix):
+        for shard in ShardedChannelWriter.load_index(export_file)["shards"]:
+            size += export_file.with_name(shard["file"]).stat().st_size
+    return size
+
+
+def iter_exported_posts(export_file: Path) -> Iterator[Dict]:
+    """Stream the posts of a channel export without loading it whole.
+
+    NDJSON exports are read line by line, Parquet exports a row group at a
+    time. JSON exports are laid out by
+    json.dumps(indent=2), one post object per indented block, which lets us
+    parse them a post at a time; anything laid out differently falls back
+    to a full parse. Compressed exports are decompressed as they are read,
+    and a sharded export's index yields the posts of all its shards.
+    """
+    if export_file.name.endswith(ShardedChannelWriter.suffix):
+        for shard in ShardedChannelWriter.load_index(export_file)["shards"]:
+            yield from iter_exported_posts(export_file.with_name(shard["file"]))
+        return
+
+    if export_file.suffix == ".parquet":
+        yield from _iter_parquet_posts(export_file)
+        return
+
+    if _split_compression(export_file)[0].suffix == ".ndjson":
+        with open_export(export_file) as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        return
+
+    with open_export(export_file) as f:
+        streaming = False
+        for line in f:
+            if line.startswith('  "posts": []'):
+                return
+            if line == '  "posts": [\n':
+                streaming = True
+                break
+
+        if streaming:
+            block = []
+            for line in f:
+                if line.startswith("  ]"):
+                    return
+                block.append(line)
+                if line in ("    }\n", "    },\n"):
+                    yield json.loads("".join(block).rstrip().rstrip(","))
+                    block = []
+            raise ValueError(f"Truncated channel export: {export_file}")
+
+    with open_export(export_file) as f:
+        yield from json.load(f)["posts"]
+
+
+class RateLimiter:
+    """Adaptive token bucket shared by every request the exporter makes.
+
+    Starts unthrottled (or at an explicit rate) and adopts the server's
+    X-Ratelimit-Limit as its ceiling once it sees one. A 429 halves the
+    rate and blocks all callers until Retry-After has passed; successful
+    requests then grow the rate back towards the ceiling. When the server
+    reports no remaining requests, callers wait out X-Ratelimit-Reset
+    instead of drawing a 429.
+    """
+
+    MIN_RATE = 1.0
+
+    def __init__(self, rate: Optional[float] = None):
+        self.rate = rate
+        self.ceiling = rate
+        self.tokens = 1.0
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """Block until a request may be sent."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    wait = self.blocked_until - now
+                elif self.rate is None:
+                    return
+                else:
+                    self.tokens = min(max(self.rate, 1.0),
+                                      self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def observe(self, response: "requests.Response") -> None:
+        """Adjust to the rate-limit headers of a response."""
+        headers = response.headers
+        with self._lock:
+            try:
+                limit = float(headers["X-Ratelimit-Limit"])
+            except (KeyError, ValueError):
+                limit = None
+            if limit:
+                self.ceiling = limit
+                if self.rate is None:
+                    self.rate = limit
+
+            if headers.get("X-Ratelimit-Remaining") == "0":
+                try:
+                    reset = float(headers.get("X-Ratelimit-Reset", 1))
+                except ValueError:
+                    reset = 1.0
+                self.blocked_until = max(self.blocked_until, time.monotonic() + reset)
+            elif response.status_code < 400 and self.rate and self.ceiling:
+                self.rate = min(self.ceiling, self.rate + 0.5)
+
+    def throttled(self, delay: float) -> None:
+        """Back off after a 429: halve the rate and pause everyone."""
+        with self._lock:
+            current = self.rate or self.ceiling or 2 * self.MIN_RATE
+            self.rate = max(self.MIN_RATE, current / 2)
+            self.tokens = 0.0
+            self.blocked_until = max(self.blocked_until, time.monotonic() + delay)
+
+
+class SharedRateLimiter(RateLimiter):
+    """RateLimiter whose bucket lives in shared memory, so that export
+    processes draw from one request budget for the whole server."""
+
+    _FIELDS = ("rate", "ceiling", "tokens", "updated", "blocked_until")
+
+    def __init__(self, rate: Optional[float] = None, context=None):
+        context = context or multiprocessing.get_context()
+        self._values = context.RawArray("d", len(self._FIELDS))
+        super().__init__(rate)
+        self._lock = context.Lock()
+
+
+def _shared_field(index: int, optional: bool) -> property:
+    def get(self):
+        value = self._values[index]
+        return None if optional and not value else value
+
+    def set(self, value):
+        self._values[index] = value or 0.0
+
+    return property(get, set)
+
+
+for _index, _name in enumerate(SharedRateLimiter._FIELDS):
+    setattr(SharedRateLimiter, _name, _shared_field(_index, _name in ("rate", "ceiling")))
+
+
+class Transport:
+    """Pooled HTTP session with retries, jittered backoff and rate limiting.
+
+    Every API call and attachment download goes through one keep-alive
+    session. Connection errors, timeouts and 429/5xx responses are retried
+    up to max_retries times with full-jitter exponential backoff (or the
+    server's Retry-After), so one throttled request no longer fails a
+    whole channel.
+    """
+
+    def __init__(self, max_retries: int = MAX_RETRIES, rate_limit: Optional[float] = None,
+                 pool_size: int = HTTP_POOL_SIZE, limiter: Optional[RateLimiter] = None):
+        self.max_retries = max_retries
+        self.limiter = limiter or RateLimiter(rate_limit)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.requests = 0
+        self.retries = 0
+        self.throttles = 0
+        self.bytes_received = 0
+        self._lock = threading.Lock()
+
+    def request(self, method: str, url: str, **kwargs) -> "requests.Response":
+        """Send a request, retrying transient failures. Error statuses that
+        are not worth retrying are returned as-is for the caller to handle."""
+        attempt = 0
+        while True:
+            self.limiter.acquire()
+            with self._lock:
+                self.requests += 1
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt >= self.max_retries:
+                    raise
+                delay = self._backoff(attempt)
+            else:
+                self.limiter.observe(response)
+                if response.status_code not in RETRY_STATUSES or attempt >= self.max_retries:
+                    if not kwargs.get("stream"):
+                        # Streamed bodies are counted by whoever reads them
+                        with self._lock:
+                            self.bytes_received += len(response.content)
+                    return response
+                delay = self._retry_after(response) or self._backoff(attempt)
+                if response.status_code == 429:
+                    self.limiter.throttled(delay)
+                    with self._lock:
+                        self.throttles += 1
+                response.close()
+
+            with self._lock:
+                self.retries += 1
+            time.sleep(delay)
+            attempt += 1
+
+    @staticmethod
+    def _backoff(attempt: int) -> float:
+        return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+    @staticmethod
+    def _retry_after(response: "requests.Response") -> Optional[float]:
+        value = response.headers.get("Retry-After") or response.headers.get("X-Ratelimit-Reset")
+        try:
+            return min(BACKOFF_MAX, max(0.0, float(value)))
+        except (TypeError, ValueError):
+            return None
+
+    def close(self) -> None:
+        self.session.close()
+
+
+class TransportClient(Client):
+    """mattermostdriver client that sends its requests through a Transport
+    (passed in the driver options) instead of bare requests calls."""
+
+    def __init__(self, options: Dict):
+        super().__init__(options)
+        self.transport: Transport = options["transport"]
+
+    def make_request(self, method, endpoint, options=None, params=None, data=None,
+                     files=None, basepath=None):
+        url = self.url
+        if basepath:
+            url = "{}://{}:{}{}".format(self._scheme, self._options["url"], self._port, basepath)
+
+        # Unlike the stock client, don't send an empty JSON body with GETs:
+        # on a kept-alive connection a server may not drain it
+        if options is None and method.lower() != "get":
+            options = {}
+        request_params = {
+            "headers": self.auth_header(),
+            "verify": self._verify,
+            "json": options,
+            "params": params or {},
+            "data": data or {},
+            "files": files,
+            "timeout": self.request_timeout,
+        }
+        if self._auth is not None:
+            request_params["auth"] = self._auth()
+
+        response = self.transport.request(method.upper(), url + endpoint, **request_params)
+        try:
+            response.raise_for_status()
+        except requests.HTTPError:
+            error = DRIVER_ERRORS.get(response.status_code)
+            if error is None:
+                raise
+            try:
+                message = response.json().get("message", response.text)
+            except (ValueError, AttributeError):
+                message = response.text
+            raise error(message) from None
+        return response
+
+
+def _pending_channels(channels: List[Dict], journal: Optional[ExportJournal]) -> List[Dict]:
+    """Drop the channels an interrupted run already finished."""
+    if not journal:
+        return channels
+    remaining = [channel for channel in channels if not journal.is_done(channel["id"])]
+    if len(remaining) < len(channels):
+        print(f"Skipping {len(channels) - len(remaining)} channel(s) "
+              "already exported by the interrupted run")
+    return remaining
+
 
 class MattermostExporter:
     """Main class for exporting Mattermost content."""
 
     def __init__(self, host: str, token: Optional[str] = None,
-                 username: Optional[str] = None, password: Optional[str] = None):
+                 username: Optional[str] = None, password: Optional[str] = None,
+                 cache: Optional[MetadataCache] = None, download_workers: int = 4,
+                 blob_store: Optional[BlobStore] = None,
+                 transport: Optional[Transport] = None, prefetch_pages: int = 4,
+                 port: int = 443, scheme: str = "https"):
         self.host = host
+        self.port = port
+        self.scheme = scheme
+        self.prefetch_pages = max(1, prefetch_pages)
+        self.metrics = ExportMetrics()
+        self.transport = transport or Transport()
         self.driver = self._connect(host, token, username, password)
+        self.cache = cache
+        self.downloader = AttachmentDownloader(self, download_workers, blob_store)
         self.user_cache: Dict[str, str] = {}
+        self.team_names: Dict[str, str] = {}
+        self._team_lock = threading.Lock()
         self.my_user_id: str = ""
         self.my_username: str = ""
+        self._local = threading.local()
 
     def _connect(self, host: str, token: Optional[str],
                  username: Optional[str], password: Optional[str]) -> Driver:
         """Establish connection to Mattermost server."""
         driver = Driver({
             "url": host,
-            "port": 443,
+            "port": self.port,
             "token": token,
             "username": username,
             "password": password,
-            "scheme": "https"
-        })
+            "scheme": self.scheme,
+            "transport": self.transport
+        }, client_cls=TransportClient)
         try:
             driver.login()
             print(f"✓ Connected to {host}")
@@ -64,59 +2167,172 @@ class MattermostExporter:
             print(f"✗ Connection failed: {e}")
             raise
 
-    def initialize_user_data(self) -> None:
-        """Load current user info and build user cache."""
+    def initialize_user_data(self, load_all_users: bool = False) -> None:
+        """Load current user info and optionally preload the user directory.
+
+        By default users are resolved lazily, in bulk, as they show up in
+        the exported channels (see resolve_users). Paging through the whole
+        directory up front only pays off when most channels are exported.
+        """
         my_user = self.driver.users.get_user("me")
         self.my_username = my_user["username"]
         self.my_user_id = my_user["id"]
+        self.user_cache[self.my_user_id] = self.my_username
         print(f"✓ Logged in as {self.my_username} ({self.my_user_id})")
 
+        if not load_all_users:
+            return
+
         # Build user cache
         print("Loading users...", end=" ", flush=True)
-        page = 0
-        while True:
-            users = self.driver.users.get_users(params={"per_page": 200, "page": page})
-            if not users:
-                break
-            for user in users:
-                self.user_cache[user["id"]] = user["username"]
-            page += 1
+        with self.metrics.timer("user_load"):
+            page = 0
+            while True:
+                users = self.driver.users.get_users(params={"per_page": 200, "page": page})
+                if not users:
+                    break
+                self._cache_users(users)
+                page += 1
         print(f"✓ {len(self.user_cache)} users loaded")
 
+    def _log(self, *args, end: str = "\n", flush: bool = False) -> None:
+        """Print progress output, or buffer it when running in an export worker."""
+        buffer = getattr(self._local, "buffer", None)
+        if buffer is None:
+            print(*args, end=end, flush=flush)
+        else:
+            print(*args, end=end, file=buffer)
+
+    def resolve_users(self, user_ids: Iterable[str]) -> None:
+        """Load any uncached users among user_ids with bulk lookups.
+
+        Users are taken from the metadata cache first; stale cache entries
+        are revalidated in bulk. Ids still unknown are fetched
+        USER_BATCH_SIZE at a time through the users-by-ids endpoint, so a
+        page of posts costs at most one request instead of one per author.
+        """
+        missing = {uid for uid in user_ids if uid and uid not in self.user_cache}
+        if not missing:
+            return
+
+        with self.metrics.timer("user_load"):
+            if self.cache:
+                cached = self.cache.get_many("user", missing)
+                for user_id, entry in cached.items():
+                    self.user_cache[user_id] = entry.data["username"]
+                self._revalidate_users({user_id: entry.fetched_at
+                                        for user_id, entry in cached.items() if not entry.fresh})
+                missing -= cached.keys()
+
+            missing = sorted(missing)
+            for start in range(0, len(missing), USER_BATCH_SIZE):
+                batch = missing[start:start + USER_BATCH_SIZE]
+                try:
+                    users = self.driver.users.get_users_by_ids(batch)
+                except Exception:
+                    # Leave the batch to get_username's one-by-one fallback
+                    continue
+                self._cache_users(users)
+                for user_id in batch:
+                    self.user_cache.setdefault(user_id, f"unknown_user_{user_id[:8]}")
+
+    def _revalidate_users(self, stale: Dict[str, float]) -> None:
+        """Refresh stale cached users, downloading only those that changed.
+
+        users-by-ids accepts a `since` timestamp and then returns just the
+        users modified after it; everyone else is still current.
+        """
+        if not stale:
+            return
+        since = int(min(stale.values()) * 1000)
+        user_ids = sorted(stale)
+        for start in range(0, len(user_ids), USER_BATCH_SIZE):
+            batch = user_ids[start:start + USER_BATCH_SIZE]
+            try:
+                changed = self.driver.client.post("/users/ids", options=batch,
+                                                  params={"since": since})
+            except Exception:
+                continue
+            self.cache.touch("user", batch)
+            self._cache_users(changed)
+
+    def _cache_users(self, users: List[Dict]) -> None:
+        """Remember fetched users in memory and in the metadata cache."""
+        for user in users:
+            self.user_cache[user["id"]] = user["username"]
+        if self.cache and users:
+            self.cache.put_many("user", {
+                user["id"]: {"id": user["id"], "username": user["username"]}
+                for user in users
+            })
+
     def get_username(self, user_id: str) -> str:
         """Get username for a user ID, fetching if not cached."""
         if user_id not in self.user_cache:
             try:
-                user = self.driver.users.get_user(user_id)
-                self.user_cache[user_id] = user["username"]
+                with self.metrics.timer("user_load"):
+                    user = self.driver.users.get_user(user_id)
+                self._cache_users([user])
             except:
                 self.user_cache[user_id] = f"unknown_user_{user_id[:8]}"
         return self.user_cache[user_id]
 
-    def _organize_threads(self, posts: List[Dict]) -> Dict[str, List[Dict]]:
-        """Organize posts into thread structures.
+    def _raw_get(self, endpoint: str, headers: Optional[Dict] = None,
+                 stream: bool = False) -> "requests.Response":
+        """GET an API endpoint with the driver's credentials, bypassing its
+        response handling (for conditional requests and streamed downloads)."""
+        client = self.driver.client
+        return self.transport.request("GET", client.url + endpoint,
+                                      headers=dict(client.auth_header() or {}, **(headers or {})),
+                                      verify=self.driver.options["verify"],
+                                      timeout=client.request_timeout,
+                                      stream=stream)
+
+    def _conditional_get(self, endpoint: str,
+                         etag: Optional[str]) -> Tuple[Optional[object], Optional[str]]:
+        """GET an API endpoint, revalidating against an ETag if we have one.
+
+        Returns (data, etag), with data None when the server answered
+        304 Not Modified.
+        """
+        response = self._raw_get(endpoint, {"If-None-Match": etag} if etag else None)
+        if response.status_code == 304:
+            return None, etag
+        response.raise_for_status()
+        return response.json(), response.headers.get("ETag")
+
+    def _get_cached(self, kind: str, key: str, endpoint: str):
+        """Fetch API metadata through the persistent cache.
 
-        Returns a dictionary mapping root post IDs to lists of reply posts.
+        Fresh entries are returned without a request; stale ones are sent
+        back to the server as a conditional GET.
         """
-        threads = {}
-        for post in posts:
-            if post.get("root_id"):
-                root_id = post["root_id"]
-                if root_id not in threads:
-                    threads[root_id] = []
-                threads[root_id].append({
-                    "id": post["id"],
-                    "idx": post["idx"],
-                    "username": post["username"],
-                    "created": post["created"],
-                    "message": post["message"]
-                })
-
-        # Sort replies in each thread by creation time
-        for root_id in threads:
-            threads[root_id].sort(key=lambda x: x["created"])
-
-        return threads
+        if not self.cache:
+            return self.driver.client.get(endpoint)
+
+        entry = self.cache.get(kind, key)
+        if entry and entry.fresh:
+            return entry.data
+
+        data, etag = self._conditional_get(endpoint, entry.etag if entry else None)
+        if data is None:
+            self.cache.touch(kind, [key])
+            return entry.data
+        self.cache.put(kind, key, data, etag)
+        return data
+
+    def get_team_name(self, team_id: str) -> str:
+        """Get a team's name, looking each team up at most once."""
+        if not team_id:
+            return "unknown"
+        with self._team_lock:
+            if team_id not in self.team_names:
+                try:
+                    team = self._get_cached("team", team_id, f"/teams/{team_id}")
+                    self.team_names[team_id] = team["name"]
+                except:
+                    self.team_names[team_id] = "unknown"
+            return self.team_names[team_id]
 
     def list_teams(self) -> List[Dict]:
         """Get all teams for current user."""
@@ -146,19 +2362,53 @@ class MattermostExporter:
     def list_channels(self, team_id: str) -> List[Dict]:
         """Get all channels for a team."""
         print("Loading channels...", end=" ", flush=True)
-        channels = self.driver.channels.get_channels_for_user(self.my_user_id, team_id)
+        channels = self._get_cached(
+            "channels", f"{self.my_user_id}:{team_id}",
+            f"/users/{self.my_user_id}/teams/{team_id}/channels"
+        )
 
         # Enhance display names for DMs
+        dm_partners = {}
         for channel in channels:
             if channel["type"] == "D":
                 user_ids = channel["name"].split("__")
                 other_id = user_ids[1] if user_ids[0] == self.my_user_id else user_ids[0]
-                channel["display_name"] = f"DM: {self.get_username(other_id)}"
+                dm_partners[channel["id"]] = other_id
+
+        self.resolve_users(dm_partners.values())
+        for channel in channels:
+            if channel["id"] in dm_partners:
+                channel["display_name"] = f"DM: {self.get_username(dm_partners[channel['id']])}"
 
         channels.sort(key=lambda x: x["display_name"].lower())
         print(f"✓ {len(channels)} channels found")
         return channels
 
+    def list_workspace_channels(
+            self, teams: List[Dict]) -> Tuple[Dict[str, List[Dict]], List[Dict], Dict[str, List[str]]]:
+        """List the channels of several teams, each channel exactly once.
+
+        The API lists the user's direct and group channels under every
+        team, so they are pulled out into one team-less list instead of
+        being exported again per team. Returns (channels by team id,
+        direct/group channels, ids of the teams each channel was listed
+        under).
+        """
+        team_channels: Dict[str, List[Dict]] = {}
+        shared: Dict[str, Dict] = {}
+        memberships: Dict[str, List[str]] = {}
+        for team in teams:
+            team_channels[team["id"]] = []
+            for channel in self.list_channels(team["id"]):
+                listed_under = memberships.setdefault(channel["id"], [])
+                listed_under.append(team["id"])
+                if channel["type"] in ("D", "G") or not channel.get("team_id"):
+                    shared.setdefault(channel["id"], channel)
+                elif len(listed_under) == 1:
+                    team_channels[team["id"]].append(channel)
+
+        return team_channels, list(shared.values()), memberships
+
     def select_channels_interactive(self, team_id: str) -> List[Dict]:
         """Interactive channel selection."""
         channels = self.list_channels(team_id)
@@ -185,57 +2435,166 @@ class MattermostExporter:
             print("Invalid selection. No channels selected.")
             return []
 
-    def export_channel(self, channel: Dict, output_dir: Path,
-                      download_files: bool = True,
-                      after: Optional[datetime] = None,
-                      before: Optional[datetime] = None) -> None:
-        """Export a single channel to JSON."""
-        channel_name = channel["display_name"].replace("/", "_").replace("\\", "_")
-        print(f"\n{'='*60}")
-        print(f"Exporting: {channel_name}")
-        print(f"{'='*60}")
-
-        # Convert datetime to timestamps
-        after_ts = after.timestamp() if after else None
-        before_ts = before.timestamp() if before else None
-
-        # Fetch all posts
-        all_posts = []
-        page = 0
-        while True:
-            print(f"  Fetching page {page}...", end=" ", flush=True)
-            response = self.driver.posts.get_posts_for_channel(
-                channel["id"],
-                params={"per_page": 200, "page": page}
-            )
-
-            if not response["posts"]:
-                print("done")
-                break
-
-            page_posts = [response["posts"][post_id] for post_id in response["order"]]
-            all_posts.extend(page_posts)
-            print(f"✓ {len(page_posts)} posts")
-            page += 1
-
-        print(f"  Total posts: {len(all_posts)}")
-
-        # Create channel directory
-        safe_name = "".join(c for c in channel_name if c.isalnum() or c in " _-").strip()
-        channel_dir = output_dir / safe_name
-        channel_dir.mkdir(parents=True, exist_ok=True)
-
-        # Process posts
-        processed_posts = []
-        for idx, post in enumerate(reversed(all_posts)):
-            created_ts = post["create_at"] / 1000
+    def plan_channels(self, channels: List[Dict],
+                      skip_unchanged: bool = False) -> List[ChannelPlan]:
+        """Estimate each channel's export cost and decide what to export.
 
-            # Apply date filters
-            if (before_ts and created_ts > before_ts) or (after_ts and created_ts < after_ts):
-                continue
+        Costs come from the channel's total_msg_count and, where this
+        channel was exported before, the sizes recorded then (see
+        _record_export). With skip_unchanged, channels with no post newer
+        than their last export are skipped (edits to old posts don't move
+        last_post_at). Returns the plans largest first, so parallel
+        workers start on the long channels and finish together.
+        """
+        history = self.cache.get_many("export", [c["id"] for c in channels]) if self.cache else {}
+        plans = []
+        for channel in channels:
+            previous = history.get(channel["id"])
+            posts = channel.get("total_msg_count", 0)
+            requests_needed = posts // POSTS_PER_PAGE + 1
+            size = posts * ESTIMATED_POST_BYTES
+            if previous:
+                record = previous.data
+                per_post = max(record["post_count"], 1)
+                size = posts * (record["export_bytes"] + record["attachment_bytes"]) // per_post
+                requests_needed += posts * record["files"] // per_post
+            skip = bool(skip_unchanged and previous and
+                        channel.get("last_post_at", 0) <= previous.data["last_post_at"])
+            plans.append(ChannelPlan(channel, posts, requests_needed, size, skip,
+                                     previous.data["export_file"] if previous else None))
+
+        plans.sort(key=lambda plan: (plan.skip, -plan.requests, -plan.size))
+        return plans
+
+    @staticmethod
+    def print_plan(plans: List[ChannelPlan]) -> None:
+        """Print an export plan as a table."""
+        export = [plan for plan in plans if not plan.skip]
+        skipped = [plan for plan in plans if plan.skip]
+        print(f"\nExport plan: {len(export)} channel(s)"
+              + (f", {len(skipped)} unchanged since the last export" if skipped else ""))
+        print(f"  {'Channel':<40} {'Posts':>9} {'Requests':>9} {'Est. size':>10}")
+        for plan in export:
+            print(f"  {plan.channel['display_name'][:40]:<40} {plan.posts:>9,} "
+                  f"{plan.requests:>9,} {_format_bytes(plan.size):>10}")
+        for plan in skipped:
+            print(f"  {plan.channel['display_name'][:40]:<40} {'(unchanged, skipped)':>30}")
+        print(f"  Total: {sum(p.posts for p in export):,} posts, "
+              f"~{sum(p.requests for p in export):,} requests, "
+              f"~{_format_bytes(sum(p.size for p in export))}")
+
+    def metrics_report(self) -> Dict:
+        """Metrics for everything this exporter has done so far: phase
+        timers, requests, cache hit rate, bytes moved and throughput."""
+        report = self.metrics.report()
+        transport = self.transport
+        downloader = self.downloader
+        report["requests"] = {
+            "total": transport.requests,
+            "retries": transport.retries,
+            "throttles": transport.throttles,
+        }
+        report["attachments"] = {
+            "downloaded": downloader.files_downloaded,
+            "from_blob_store": downloader.files_reused,
+            "bytes": downloader.bytes_downloaded,
+        }
+        report["bytes"] = {
+            "received": transport.bytes_received + downloader.bytes_downloaded,
+            "written": report["counters"].get("export_bytes", 0) + downloader.bytes_downloaded,
+        }
+        cache = self.cache
+        report["cache"] = {
+            "hits": cache.hits if cache else 0,
+            "stale": cache.stale if cache else 0,
+            "misses": cache.misses if cache else 0,
+        }
+        _add_metric_rates(report)
+        return report
+
+    def _record_export(self, channel: Dict, channel_info: Dict, export_file: Path,
+                       files: int, attachment_bytes: int) -> None:
+        """Remember what a channel export cost (posts, export size, attachments
+        downloaded), for planning later runs."""
+        if not self.cache:
+            return
+        self.cache.put("export", channel["id"], {
+            "last_post_at": channel.get("last_post_at", 0),
+            "post_count": channel_info["post_count"],
+            "export_bytes": export_size(export_file),
+            "files": files,
+            "attachment_bytes": attachment_bytes,
+            "export_file": str(export_file.resolve()),
+        })
 
+    def _fetch_post_page(self, channel_id: str, anchor: Optional[str], offset: int) -> Dict:
+        """Request the page `offset` pages older than the anchor post."""
+        params = {"per_page": POSTS_PER_PAGE}
+        if anchor:
+            params["before"] = anchor
+        if offset:
+            params["page"] = offset
+        with self.metrics.timer("page_fetch"):
+            return self.driver.posts.get_posts_for_channel(channel_id, params=params)
+
+    def _iter_post_pages(self, channel_id: str, after_ts: Optional[float] = None,
+                         cursor: Optional[str] = None, page: int = 0) -> Iterator[List[Dict]]:
+        """Yield a channel's posts page by page, newest first.
+
+        Pages are requested relative to a post-id anchor (`before=<oldest post
+        seen>`) rather than from the newest post, so each request costs the
+        server about the same regardless of how deep into the history we
+        are, and posts arriving mid-export don't shift the pages. Up to
+        prefetch_pages consecutive pages below the anchor (`page=0..K-1`)
+        are in flight at once, so the round trips overlap with spooling
+        and user lookups; the anchor then moves to the oldest post fetched.
+        Paging stops as soon as a page reaches posts created before
+        `after_ts`, so a date-bounded export only downloads the window plus
+        anything newer than it. A resumed fetch passes the cursor and page
+        number it stopped at.
+        """
+        executor = ThreadPoolExecutor(max_workers=self.prefetch_pages,
+                                      thread_name_prefix="mm-pages")
+        try:
+            anchor = cursor
+            while True:
+                # The newest page is fetched on its own to pin the first anchor
+                batch = self.prefetch_pages if anchor else 1
+                futures = [executor.submit(self._fetch_post_page, channel_id, anchor, offset)
+                           for offset in range(batch)]
+                for future in futures:
+                    self._log(f"  Fetching page {page}...", end=" ", flush=True)
+                    response = future.result()
+
+                    order = response.get("order") or []
+                    if not order:
+                        self._log("done")
+                        return
+
+                    page_posts = [response["posts"][post_id] for post_id in order]
+                    self._log(f"✓ {len(page_posts)} posts")
+                    self.metrics.count("pages_fetched")
+                    self.metrics.count("posts_fetched", len(page_posts))
+                    yield page_posts
+
+                    if after_ts and page_posts[-1]["create_at"] / 1000 < after_ts:
+                        self._log("  Reached start of date range")
+                        return
+                    if len(order) < POSTS_PER_PAGE:
+                        return
+
+                    anchor = order[-1]
+                    page += 1
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _process_post(self, post: Dict, idx: int, channel_dir: Path,
+                      downloads: Optional[DownloadBatch],
+                      code_archive: Optional[CodeArchive] = None) -> Dict:
+        """Convert a raw API post to export format, saving code and attachments."""
+        with self.metrics.timer("transform"):
             username = self.get_username(post["user_id"])
-            created = datetime.utcfromtimestamp(created_ts).isoformat() + "Z"
+            created = datetime.utcfromtimestamp(post["create_at"] / 1000).isoformat() + "Z"
 
             post_data = {
                 "idx": idx,
@@ -251,82 +2610,438 @@ class MattermostExporter:
                 post_data["is_reply"] = True
 
             # Extract code blocks
-            message = post["message"]
-            if message.count("```") >= 2:
-                start = message.find("```") + 3
-                end = message.rfind("```")
-                code = message[start:end].strip()
-                if code:
-                    code_file = channel_dir / f"{idx:04d}_code.txt"
-                    code_file.write_text(code, encoding="utf-8")
-                    post_data["code_file"] = code_file.name
+            if code_archive is not None and "```" in post["message"]:
+                with self.metrics.timer("code_extraction"):
+                    blocks = extract_code_blocks(post["message"])
+                    if blocks:
+                        post_data["code_blocks"] = [code_archive.add(language, code)
+                                                    for language, code in blocks]
+                        self.metrics.count("code_blocks", len(blocks))
 
             # Download attachments
             if "files" in post.get("metadata", {}):
                 filenames = []
+                files_meta = []
+                skipped = []
                 for file_info in post["metadata"]["files"]:
                     filename = f"{idx:04d}_{file_info['name']}"
                     filenames.append(file_info['name'])
+                    files_meta.append({
+                        "name": file_info["name"],
+                        "size": file_info.get("size"),
+                        "mime_type": file_info.get("mime_type")
+                    })
+                    if downloads is None:
+                        continue
+
+                    reason = downloads.filter.skip_reason(file_info)
+                    if reason:
+                        skipped.append({"name": file_info["name"], "reason": reason})
+                        continue
+
+                    rendition = downloads.filter.rendition(file_info)
+                    compression = downloads.compression_for(file_info, rendition)
+                    file_path = channel_dir / (filename + RENDITION_SUFFIXES[rendition]
+                                               + COMPRESSION_SUFFIXES.get(compression, ""))
+                    if not file_path.exists():
+                        downloads.add(file_info, file_path, rendition, compression)
 
-                    if download_files:
-                        try:
-                            print(f"  Downloading: {file_info['name']}...", end=" ", flush=True)
-                            file_data = self.driver.files.get_file(file_info["id"])
+                post_data["files"] = filenames
+                post_data["files_meta"] = files_meta
+                if skipped:
+                    post_data["files_skipped"] = skipped
 
-                            file_path = channel_dir / filename
-                            if isinstance(file_data, dict):
-                                file_path.write_text(json.dumps(file_data, indent=2))
-                            else:
-                                file_path.write_bytes(file_data.content)
-                            print("✓")
-                        except Exception as e:
-                            print(f"✗ {e}")
+            return post_data
 
-                post_data["files"] = filenames
+    def _fetch_channel_changes(self, channel_id: str, state: Dict) -> List[Dict]:
+        """Fetch posts created, edited or deleted since the last sync.
 
-            processed_posts.append(post_data)
+        Uses the server's `since` filter, which returns every post updated
+        after a timestamp (deleted posts included) in a single request. The
+        server caps that response, so when the cap is hit new posts are
+        collected with a cursor walk instead.
+        """
+        self._log("  Fetching changes since last sync...", end=" ", flush=True)
+        response = self.driver.posts.get_posts_for_channel(
+            channel_id,
+            params={"since": state["last_update_at"] + 1}
+        )
+        changed = dict(response.get("posts") or {})
+        self._log(f"✓ {len(changed)} changed posts")
+
+        if len(changed) >= SINCE_POST_LIMIT:
+            self._log("  Change list truncated by server; walking new posts instead")
+            self._log("  (edits to older posts beyond the limit are not picked up)")
+            after_ts = state["last_create_at"] / 1000
+            for page_posts in self._iter_post_pages(channel_id, after_ts):
+                for post in page_posts:
+                    changed[post["id"]] = post
+
+        self.resolve_users(post["user_id"] for post in changed.values())
+        return sorted(changed.values(), key=lambda p: p["create_at"])
+
+    def _fetch_thread_roots(self, root_ids: List[str]) -> Dict[str, Dict]:
+        """Fetch thread roots that are missing from an export (posted before
+        its date window, say), POST_BATCH_SIZE per posts-by-ids request.
+
+        Returns the roots in the same form as thread replies, by id. Roots
+        that were deleted or can't be read are left out.
+        """
+        roots = {}
+        with self.metrics.timer("thread_roots"):
+            for start in range(0, len(root_ids), POST_BATCH_SIZE):
+                batch = root_ids[start:start + POST_BATCH_SIZE]
+                try:
+                    posts = self.driver.client.post("/posts/ids", options=batch)
+                except (ResourceNotFound, NotEnoughPermissions):
+                    continue
+                posts = [post for post in posts if not post.get("delete_at")]
+                self.resolve_users(post["user_id"] for post in posts)
+                for post in posts:
+                    roots[post["id"]] = {
+                        "id": post["id"],
+                        "username": self.get_username(post["user_id"]),
+                        "created": datetime.utcfromtimestamp(
+                            post["create_at"] / 1000).isoformat() + "Z",
+                        "message": post["message"]
+                    }
+        self.metrics.count("thread_roots_fetched", len(roots))
+        self._log(f"  Thread roots outside the export: {len(roots)} of "
+                  f"{len(root_ids)} fetched")
+        return roots
+
+    def _merge_channel_changes(self, previous_posts: Iterable[Dict], changes: List[Dict],
+                               state: Dict, channel_dir: Path,
+                               downloads: Optional[DownloadBatch],
+                               code_archive: Optional[CodeArchive],
+                               before_ts: Optional[float], next_idx: int = 0) -> Iterator[Dict]:
+        """Stream previously exported posts with changed posts merged in.
+
+        Edited posts are reprocessed in place and keep their idx, deleted
+        posts are dropped, and new posts are appended with fresh idx values
+        (from next_idx on, or after the last previous post).
+        """
+        changes_by_id = {post["id"]: post for post in changes}
+        merged_ids = set()
+        added = edited = deleted = 0
+
+        for post_data in previous_posts:
+            next_idx = max(next_idx, post_data["idx"] + 1)
+            change = changes_by_id.get(post_data["id"])
+            if change is None:
+                yield post_data
+                continue
+
+            merged_ids.add(change["id"])
+            if change.get("delete_at"):
+                deleted += 1
+                continue
+            edited += 1
+            yield self._process_post(change, post_data["idx"], channel_dir, downloads,
+                                     code_archive)
+
+        for post in changes:
+            if post.get("delete_at") or post["id"] in merged_ids:
+                continue
+            if post["create_at"] <= state["last_create_at"]:
+                continue
+            if before_ts and post["create_at"] / 1000 > before_ts:
+                continue
+            yield self._process_post(post, next_idx, channel_dir, downloads, code_archive)
+            next_idx += 1
+            added += 1
+
+        self._log(f"  Merged: {added} new, {edited} edited, {deleted} deleted")
+
+    def _iter_channel_posts(self, channel_id: str, channel_dir: Path,
+                            downloads: Optional[DownloadBatch],
+                            code_archive: Optional[CodeArchive], after_ts: Optional[float],
+                            before_ts: Optional[float], sync_state: Dict,
+                            journal: Optional[ExportJournal] = None) -> Iterator[Dict]:
+        """Fetch and transform a channel's posts, yielding them oldest first.
+
+        Pages are spooled to disk as they arrive and replayed in reverse, so
+        only one page of raw posts is held in memory at a time. With a
+        journal, every spooled page is checkpointed and an interrupted
+        channel keeps its spool, so the next run continues from the last
+        page instead of page 0.
+        """
+        def track(page_posts: List[Dict]) -> None:
+            in_window = [post for post in page_posts
+                         if _in_window(post, after_ts, before_ts)]
+            for post in in_window:
+                SyncManifest.advance(sync_state, post)
+            self.resolve_users(post["user_id"] for post in in_window)
+
+        spool_path = channel_dir / ".pages.tmp"
+        checkpoint = journal.checkpoint(channel_id) if journal else None
+        if checkpoint and not spool_path.exists():
+            checkpoint = None
+        spool = PageSpool(spool_path, checkpoint["spool_size"] if checkpoint else None)
+        try:
+            if checkpoint:
+                self._log(f"  Resuming after {spool.page_count} pages "
+                          f"({spool.post_count} posts)")
+                for page_posts in spool.iter_pages():
+                    track(page_posts)
+
+            if not checkpoint or checkpoint["status"] != "fetched":
+                # Fetch posts, newest first, until we walk past the requested window
+                pages = self._iter_post_pages(channel_id, after_ts,
+                                              checkpoint and checkpoint["cursor"],
+                                              spool.page_count)
+                for page_posts in pages:
+                    spool.append(page_posts)
+                    track(page_posts)
+                    if journal:
+                        journal.page_fetched(channel_id, page_posts[-1]["id"], spool)
+                if journal:
+                    journal.fetch_complete(channel_id, spool)
+
+            self._log(f"  Total posts: {spool.post_count}")
+
+            # Process posts, numbering them from the first one in the window
+            idx = 0
+            for post in spool.iter_oldest_first():
+                # Apply date filters
+                if not _in_window(post, after_ts, before_ts):
+                    continue
+
+                yield self._process_post(post, idx, channel_dir, downloads, code_archive)
+                idx += 1
+        except BaseException:
+            spool.close(keep=journal is not None)
+            raise
+        spool.close()
+
+    def export_channel(self, channel: Dict, output_dir: Path,
+                      download_files: bool = True,
+                      after: Optional[datetime] = None,
+                      before: Optional[datetime] = None,
+                      manifest: Optional[SyncManifest] = None,
+                      output_format: str = "json",
+                      attachment_filter: Optional[AttachmentFilter] = None,
+                      journal: Optional[ExportJournal] = None,
+                      compression: Optional[str] = None,
+                      partition: Optional[Union[str, int]] = None,
+                      search_index: Optional[Path] = None) -> None:
+        """Export a single channel to JSON (or NDJSON, see CHANNEL_WRITERS).
+
+        Posts stream from the API through processing into the output file,
+        so memory use is bounded by a page rather than the channel size.
+        With a sync manifest, a channel that was exported before is updated
+        in place with only the posts that changed since the last run.
+        `compression` ("gzip" or "zstd") compresses the output and the
+        compressible attachments as they are written. `partition` ("month",
+        or a number of posts) splits the export into shards listed in a
+        `<channel>.index.json` (see ShardedChannelWriter); incremental syncs
+        then rewrite only the shards with changes. With a `search_index`
+        database, posts are also written to its full-text index.
+        """
+        channel_name = channel["display_name"].replace("/", "_").replace("\\", "_")
+        self._log(f"\n{'='*60}")
+        self._log(f"Exporting: {channel_name}")
+        self._log(f"{'='*60}")
+
+        # Convert datetime to timestamps
+        after_ts = after.timestamp() if after else None
+        before_ts = before.timestamp() if before else None
+
+        # Create channel directory
+        safe_name = "".join(c for c in channel_name if c.isalnum() or c in " _-").strip()
+        channel_dir = output_dir / safe_name
+        channel_dir.mkdir(parents=True, exist_ok=True)
+        writer_cls = CHANNEL_WRITERS[output_format]
+        if partition:
+            export_file = channel_dir / f"{safe_name}{ShardedChannelWriter.suffix}"
+        else:
+            export_file = channel_dir / _export_file_name(safe_name, writer_cls, compression)
+
+        # Attachments download in the background while posts are processed
+        downloads = (self.downloader.batch(attachment_filter, compression)
+                     if download_files else None)
+
+        state = manifest.get(channel["id"]) if manifest else None
+        sync_state = SyncManifest.new_state(state)
+        kept_shards = []
+        deleted_ids = []
+        incremental = bool(state) and export_file.exists()
+        code_archive = CodeArchive(channel_dir / f"{safe_name}.code", append=incremental)
+        if incremental:
+            # Incremental sync: fetch only what changed and merge it in
+            changes = self._fetch_channel_changes(channel["id"], state)
+            if not changes:
+                self._log(f"✓ Up to date: {export_file}")
+                return
+            for post in changes:
+                if _in_window(post, None, before_ts):
+                    SyncManifest.advance(sync_state, post)
+            deleted_ids = [post["id"] for post in changes if post.get("delete_at")]
+            if partition:
+                shards = ShardedChannelWriter.load_index(export_file)["shards"]
+                kept_shards, rewrite = _split_shards(shards, changes)
+                self._log(f"  Rewriting {len(rewrite)} of {len(shards)} shards")
+                previous_posts = (post_data for shard in rewrite
+                                  for post_data in
+                                  iter_exported_posts(channel_dir / shard["file"]))
+                next_idx = max((shard["last_idx"] + 1 for shard in shards), default=0)
+            else:
+                previous_posts, next_idx = iter_exported_posts(export_file), 0
+            posts = self._merge_channel_changes(previous_posts, changes, state, channel_dir,
+                                                downloads, code_archive, before_ts, next_idx)
+        else:
+            posts = self._iter_channel_posts(channel["id"], channel_dir, downloads,
+                                             code_archive, after_ts, before_ts, sync_state,
+                                             journal)
 
         # Get team info
+        team_name = self.get_team_name(channel["team_id"])
+        channel_header = {
+            "id": channel["id"],
+            "name": channel["name"],
+            "display_name": channel["display_name"],
+            "type": channel["type"],
+            "team": team_name,
+            "team_id": channel["team_id"],
+            "header": channel.get("header", ""),
+            "purpose": channel.get("purpose", ""),
+        }
+
+        if partition:
+            writer = ShardedChannelWriter(export_file, writer_cls, partition, compression,
+                                          channel_header, self._fetch_thread_roots)
+            writer.keep(kept_shards)
+        else:
+            writer = _open_channel_writer(writer_cls, export_file, compression,
+                                          self._fetch_thread_roots, channel["id"])
+        search = SearchIndex(search_index) if search_index else None
         try:
-            team_info = self.driver.teams.get_team(channel["team_id"])
-            team_name = team_info["name"]
-        except:
-            team_name = "unknown"
-
-        # Organize threads
-        threads = self._organize_threads(processed_posts)
-        thread_count = len([p for p in processed_posts if p.get("is_reply")])
-
-        # Build export data
-        export_data = {
-            "channel": {
-                "id": channel["id"],
-                "name": channel["name"],
-                "display_name": channel["display_name"],
-                "type": channel["type"],
-                "team": team_name,
-                "team_id": channel["team_id"],
-                "header": channel.get("header", ""),
-                "purpose": channel.get("purpose", ""),
-                "exported_at": datetime.utcnow().isoformat() + "Z",
-                "post_count": len(processed_posts),
-                "thread_count": thread_count
-            },
-            "posts": processed_posts,
-            "threads": threads
+            for post_data in posts:
+                with self.metrics.timer("write"):
+                    writer.write_post(post_data)
+                if search:
+                    search.add(channel["id"], post_data)
+
+            with self.metrics.timer("write"):
+                code_archive.close()
+                channel_info = writer.close(dict(
+                    channel_header,
+                    exported_at=datetime.utcnow().isoformat() + "Z"
+                ))
+            if search:
+                with self.metrics.timer("search_index"):
+                    search.finish_channel(channel_info, export_file, not incremental,
+                                          deleted_ids, self.user_cache, after_ts, before_ts)
+        except BaseException:
+            code_archive.abort()
+            writer.abort()
+            raise
+        finally:
+            if search:
+                search.close()
+
+        files = reused = size = 0
+        if downloads is not None:
+            files, reused, size, errors, elapsed = downloads.wait()
+            for name, error in errors:
+                self._log(f"  ✗ Download failed: {name}: {error}")
+            if files:
+                self._log(f"  Attachments: {files} saved ({reused} from blob store), "
+                          f"{_format_bytes(size)} downloaded "
+                          f"({_format_bytes(size / max(elapsed, 1e-6))}/s)")
+
+        with contextlib.closing(WorkspaceThreadIndex(output_dir)) as thread_index:
+            thread_index.replace_channel(channel["id"], channel_dir, writer.thread_parts,
+                                         (shard["shard"] for shard in kept_shards))
+
+        if manifest is not None:
+            if before_ts:
+                SyncManifest.hold_back(sync_state, before_ts)
+            manifest.record(channel["id"], sync_state, export_file)
+        if journal is not None:
+            journal.channel_done(channel["id"], export_file)
+        self._record_export(channel, channel_info, export_file, files - reused, size)
+        self.metrics.count("channels_exported")
+        self.metrics.count("posts_exported", channel_info["post_count"])
+        self.metrics.count("export_bytes", export_size(export_file))
+
+        self._log(f"✓ Exported to: {export_file}")
+        self._log(f"  Posts: {channel_info['post_count']}")
+        if code_archive.added:
+            self._log(f"  Code blocks: {code_archive.added} new snippets in {code_archive.path.name} "
+                      f"({len(code_archive.snippets)} distinct)")
+        if channel_info["thread_count"] > 0:
+            self._log(f"  Thread replies: {channel_info['thread_count']} "
+                      f"across {writer.threads.thread_count} threads")
+
+    def _export_channel_task(self, channel: Dict, output_dir: Path,
+                             buffered: bool, export_kwargs: Dict) -> Dict:
+        """Export one channel, isolating errors and optionally buffering output."""
+        buffer = io.StringIO() if buffered else None
+        self._local.buffer = buffer
+        error = None
+        try:
+            self.export_channel(channel, output_dir, **export_kwargs)
+        except Exception as e:
+            error = str(e)
+            self._log(f"✗ Error exporting {channel['display_name']}: {e}")
+            self._log(traceback.format_exc(), end="")
+        finally:
+            self._local.buffer = None
+
+        return {
+            "channel": channel,
+            "error": error,
+            "output": buffer.getvalue() if buffer else ""
         }
 
-        # Write JSON export
-        json_file = channel_dir / f"{safe_name}.json"
-        json_file.write_text(
-            json.dumps(export_data, indent=2, ensure_ascii=False),
-            encoding="utf-8"
-        )
+    def export_channels(self, channels: List[Dict], output_dir: Path,
+                        workers: int = 1, **export_kwargs) -> List[Dict]:
+        """Export several channels, running up to `workers` exports at once.
+
+        Each channel's progress output is buffered in its worker and printed
+        as one block when the channel finishes, so parallel exports don't
+        interleave. A failing channel is reported and skipped without
+        affecting the others. Returns one result dict per channel.
+
+        Channels the export journal (if any) records as finished are skipped.
+        """
+        channels = _pending_channels(channels, export_kwargs.get("journal"))
+        total = len(channels)
+        results = []
 
-        print(f"✓ Exported to: {json_file}")
-        print(f"  Posts: {len(processed_posts)}")
-        if thread_count > 0:
-            print(f"  Thread replies: {thread_count} across {len(threads)} threads")
+        if workers <= 1:
+            try:
+                for idx, channel in enumerate(channels, 1):
+                    print(f"\n[{idx}/{total}]")
+                    results.append(
+                        self._export_channel_task(channel, output_dir, False, export_kwargs)
+                    )
+            except KeyboardInterrupt:
+                self.downloader.close(cancel=True)
+                raise
+            return results
+
+        executor = ThreadPoolExecutor(max_workers=workers,
+                                      thread_name_prefix="mm-export")
+        try:
+            futures = [
+                executor.submit(self._export_channel_task, channel, output_dir,
+                                True, export_kwargs)
+                for channel in channels
+            ]
+            for done, future in enumerate(as_completed(futures), 1):
+                result = future.result()
+                status = "✗" if result["error"] else "✓"
+                print(f"\n[{done}/{total}] {status} {result['channel']['display_name']}")
+                print(result["output"], end="", flush=True)
+                results.append(result)
+        except KeyboardInterrupt:
+            executor.shutdown(wait=False, cancel_futures=True)
+            self.downloader.close(cancel=True)
+            raise
+        executor.shutdown()
+        return results
 
 
 def find_firefox_token(host: str) -> Optional[str]:
@@ -385,6 +3100,494 @@ def save_config(config: Dict, config_file: Path) -> None:
         print(f"Warning: Could not save config: {e}")
 
 
+def parse_size(value: str) -> int:
+    """Parse a byte size such as 500KB, 50MB or 2G."""
+    units = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+    number = value.strip().upper().rstrip("B")
+    unit = number[-1] if number and number[-1] in units else ""
+    try:
+        return int(float(number[:len(number) - len(unit)]) * units[unit])
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid size: {value}")
+
+
+def _compression_arg(value: str) -> str:
+    """argparse type for --compress: a known codec whose module is installed."""
+    if value not in COMPRESSION_SUFFIXES:
+        raise argparse.ArgumentTypeError(
+            f"invalid choice: {value!r} (choose from {', '.join(COMPRESSION_SUFFIXES)})"
+        )
+    if value == "zstd" and zstandard is None:
+        raise argparse.ArgumentTypeError("zstd needs the zstandard package: "
+                                         "pip install zstandard")
+    return value
+
+
+def _format_arg(value: str) -> str:
+    """argparse type for --format: Parquet output needs pyarrow installed."""
+    if value == "parquet" and pa is None:
+        raise argparse.ArgumentTypeError("parquet needs the pyarrow package: "
+                                         "pip install pyarrow")
+    return value
+
+
+def _partition_arg(value: str) -> Union[str, int]:
+    """argparse type for --partition: "month" or a number of posts per shard."""
+    if value == "month":
+        return value
+    try:
+        size = int(value)
+    except ValueError:
+        size = 0
+    if size <= 0:
+        raise argparse.ArgumentTypeError(f"expected 'month' or a post count, got {value!r}")
+    return size
+
+
+def _comma_list(value: str) -> List[str]:
+    return [item.strip().lower() for item in value.split(",") if item.strip()]
+
+
+def add_export_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add export engine options shared by all exporter scripts."""
+    parser.add_argument("--workers", type=int, default=1,
+                       help="Number of channels to export concurrently (default: 1)")
+    parser.add_argument("--download-workers", type=int, default=4,
+                       help="Number of attachments to download concurrently (default: 4)")
+    parser.add_argument("--prefetch-pages", type=int, default=4,
+                       help="Post pages requested ahead within a channel (default: 4)")
+    parser.add_argument("--max-file-size", type=parse_size,
+                       help="Skip attachments larger than this, e.g. 50MB")
+    parser.add_argument("--mime-allow", type=_comma_list, default=[],
+                       help="Only download these MIME types (comma-separated, wildcards "
+                            "allowed, e.g. 'image/*,application/pdf')")
+    parser.add_argument("--mime-deny", type=_comma_list, default=[],
+                       help="Never download these MIME types, e.g. 'video/*'")
+    parser.add_argument("--files-mode", choices=["original", "preview", "thumbnail"],
+                       default="original",
+                       help="Fetch original files, or only the server's preview/thumbnail "
+                            "images; files without one are skipped unless --mime-allow "
+                            "lists their type (default: original)")
+    parser.add_argument("--blob-store", type=Path,
+                       help="Content-addressed attachment store shared across channels and "
+                            "runs (default: 'blobs' next to the export directories)")
+    parser.add_argument("--no-blob-store", action="store_true",
+                       help="Download every attachment into its channel directory")
+    parser.add_argument("--max-retries", type=int, default=MAX_RETRIES,
+                       help="Retries for throttled or failed requests, with jittered "
+                            f"exponential backoff (default: {MAX_RETRIES})")
+    parser.add_argument("--rate-limit", type=float,
+                       help="Initial requests per second; adapts to the server's rate-limit "
+                            "headers (default: unthrottled until the server reports a limit)")
+    parser.add_argument("--all-users", action="store_true",
+                       help="Load the whole user directory at startup instead of resolving "
+                            "users as they appear (faster when exporting most channels)")
+    parser.add_argument("--cache-db", type=Path, default=Path(".mattermost_cache.sqlite"),
+                       help="Metadata cache shared across runs and scripts "
+                            "(default: .mattermost_cache.sqlite)")
+    parser.add_argument("--cache-ttl", type=float, default=CACHE_TTLS["user"],
+                       help="Seconds before cached users and teams are revalidated "
+                            f"(default: {CACHE_TTLS['user']})")
+    parser.add_argument("--no-cache", action="store_true",
+                       help="Don't use the persistent metadata cache")
+    parser.add_argument("--skip-unchanged", action="store_true",
+                       help="Skip channels with no new posts since their last export "
+                            "(export history is kept in the metadata cache)")
+    parser.add_argument("--dry-run", action="store_true",
+                       help="Print the export plan (estimated requests and size per "
+                            "channel) without exporting anything")
+    parser.add_argument("--profile", action="store_true",
+                       help="Profile the run with cProfile and tracemalloc (results in "
+                            "export_profile.pstats and export_metrics.json)")
+    parser.add_argument("--resume", type=Path, metavar="DIR",
+                       help="Resume an interrupted export in DIR: finished channels are "
+                            "skipped and a partly fetched channel continues from its last page")
+    parser.add_argument("--format", type=_format_arg, choices=sorted(CHANNEL_WRITERS),
+                       default="json",
+                       help="Channel output format: one JSON document, NDJSON with one "
+                            "post per line plus channel/thread sidecars, or Parquet post, "
+                            "thread and attachment tables (needs pyarrow; default: json)")
+    parser.add_argument("--partition", type=_partition_arg, metavar="{month,N}",
+                       help="Split each channel export into shards per month or per N "
+                            "posts, listed in <channel>.index.json; incremental syncs "
+                            "rewrite only the shards that changed")
+    parser.add_argument("--search-index", type=Path, metavar="DB",
+                       help="Also index exported posts in this SQLite full-text search "
+                            "database (shared across runs; see SearchIndex.search)")
+    parser.add_argument("--compress", type=_compression_arg, metavar="{gzip,zstd}",
+                       help="Compress channel output and compressible attachments while "
+                            "they are written (zstd needs the zstandard package; already "
+                            "compressed types such as images and archives are kept as-is)")
+
+
+def add_workspace_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add options for scripts that export a whole workspace (see
+    ExportProcessPool), on top of add_export_arguments."""
+    parser.add_argument("--processes", type=int, default=1,
+                       help="Export channels in this many worker processes sharing one "
+                            "request-rate budget (default: 1)")
+
+
+def plan_from_args(exporter: MattermostExporter, channels: List[Dict],
+                   args: argparse.Namespace) -> Tuple[List[Dict], List[Dict]]:
+    """Print the export plan for channels.
+
+    Returns the channels to export, largest first (none for a --dry-run),
+    and the channels skipped as unchanged with the export file their data
+    is still in (see summarize_results).
+    """
+    plans = exporter.plan_channels(channels, skip_unchanged=args.skip_unchanged)
+    exporter.print_plan(plans)
+    skipped = [
+        {
+            "id": plan.channel["id"],
+            "display_name": plan.channel["display_name"],
+            "export_file": plan.export_file
+        }
+        for plan in plans if plan.skip
+    ]
+    if args.dry_run:
+        return [], skipped
+    return [plan.channel for plan in plans if not plan.skip], skipped
+
+
+def open_export_journal(args: argparse.Namespace, output_dir: Path) -> ExportJournal:
+    """Open the progress journal for output_dir, replaying it when resuming."""
+    return ExportJournal(output_dir, resume=args.resume is not None)
+
+
+def transport_from_args(args: argparse.Namespace,
+                        limiter: Optional[RateLimiter] = None) -> Transport:
+    """Build the HTTP transport selected by the add_export_arguments options.
+
+    The connection pool is sized for the most requests that can be in
+    flight at once: every channel worker's prefetched pages plus the
+    attachment downloads.
+    """
+    pages_in_flight = args.workers * max(1, args.prefetch_pages)
+    pool_size = max(HTTP_POOL_SIZE, pages_in_flight + args.download_workers)
+    return Transport(max_retries=args.max_retries, rate_limit=args.rate_limit,
+                     pool_size=pool_size, limiter=limiter)
+
+
+def build_exporter(args: argparse.Namespace, host: str, exports_root: Path,
+                   transport: Optional[Transport] = None, **connection) -> MattermostExporter:
+    """Connect an exporter configured by the add_export_arguments options.
+
+    connection holds MattermostExporter's token or username/password, and
+    port/scheme for servers not on HTTPS port 443.
+    """
+    return MattermostExporter(
+        host=host,
+        cache=open_metadata_cache(args, host),
+        download_workers=args.download_workers,
+        prefetch_pages=args.prefetch_pages,
+        blob_store=open_blob_store(args, exports_root),
+        transport=transport or transport_from_args(args),
+        **connection
+    )
+
+
+# State of an export worker process (see ExportProcessPool)
+_worker: Dict = {}
+
+
+def _start_export_worker(*worker_args) -> None:
+    _worker["args"] = worker_args
+
+
+def _export_in_worker(channel: Dict, output_dir: Path, journal_dir: Optional[Path],
+                      export_kwargs: Dict) -> Dict:
+    if "exporter" not in _worker:
+        # Connect on the first task, so a login failure is reported with it
+        args, host, exports_root, credentials, limiter = _worker["args"]
+        with contextlib.redirect_stdout(io.StringIO()):
+            exporter = build_exporter(args, host, exports_root,
+                                      transport_from_args(args, limiter), **credentials)
+            exporter.initialize_user_data(load_all_users=args.all_users)
+        _worker["exporter"] = exporter
+        _worker["journal"] = ExportJournal(journal_dir, resume=True) if journal_dir else None
+
+    exporter = _worker["exporter"]
+    result = exporter._export_channel_task(channel, output_dir, True,
+                                           dict(export_kwargs, journal=_worker["journal"]))
+    transport = exporter.transport
+    result["worker"] = {
+        "pid": os.getpid(),
+        "requests": transport.requests,
+        "retries": transport.retries,
+        "throttles": transport.throttles,
+    }
+    result["metrics"] = exporter.metrics_report()
+    return result
+
+
+class ExportProcessPool:
+    """Exports channels in worker processes, one channel per task.
+
+    Each process connects its own exporter (own session and connection
+    pool), so JSON encoding and post processing run in parallel. All
+    processes share one rate limiter and stay within the server's budget
+    together. Channels are handed out in the given (largest-first) order
+    as processes become free.
+    """
+
+    def __init__(self, processes: int, args: argparse.Namespace, host: str,
+                 exports_root: Path, credentials: Dict):
+        context = multiprocessing.get_context("spawn")
+        self.limiter = SharedRateLimiter(args.rate_limit, context)
+        self.worker_metrics: Dict[int, Dict] = {}
+        self._executor = ProcessPoolExecutor(
+            max_workers=processes, mp_context=context, initializer=_start_export_worker,
+            initargs=(args, host, exports_root, credentials, self.limiter)
+        )
+
+    def export_channels(self, channels: List[Dict], output_dir: Path,
+                        journal: Optional[ExportJournal] = None,
+                        **export_kwargs) -> List[Dict]:
+        """Export channels like MattermostExporter.export_channels, then shut
+        the pool down. Each result also carries its worker's request counters
+        under "worker".
+
+        A channel whose task fails outside export_channel (a worker that
+        can't log in, or a process that dies) is reported as failed like
+        any other channel error; the remaining channels still run.
+        """
+        channels = _pending_channels(channels, journal)
+        journal_dir = journal.path.parent if journal else None
+        total = len(channels)
+        results = []
+        cancel = True
+        try:
+            futures = {self._executor.submit(_export_in_worker, channel, output_dir,
+                                             journal_dir, export_kwargs): channel
+                       for channel in channels}
+            for done, future in enumerate(as_completed(futures), 1):
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = {"channel": futures[future], "error": str(e) or repr(e),
+                              "output": f"✗ Worker failed: {e!r}\n"}
+                else:
+                    # Worker metrics are cumulative; keep each process's latest
+                    self.worker_metrics[result["worker"]["pid"]] = result.pop("metrics")
+                status = "✗" if result["error"] else "✓"
+                print(f"\n[{done}/{total}] {status} {result['channel']['display_name']}")
+                print(result["output"], end="", flush=True)
+                results.append(result)
+            cancel = False
+        finally:
+            self.close(cancel=cancel)
+        return results
+
+    def close(self, cancel: bool = False) -> None:
+        self._executor.shutdown(wait=not cancel, cancel_futures=cancel)
+
+
+class RunProfiler:
+    """cProfile and tracemalloc over a run (--profile).
+
+    cProfile only sees the thread that started it, so profile with
+    --workers 1 (the default), where channels are processed and written
+    on the main thread.
+    """
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+        tracemalloc.start()
+        self.profile.enable()
+
+    def stop(self, output_dir: Path) -> Dict:
+        """Stop profiling, save the profile and print its top functions.
+        Returns a summary for the metrics file."""
+        self.profile.disable()
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        stats_file = output_dir / "export_profile.pstats"
+        self.profile.dump_stats(str(stats_file))
+        print("\nProfile (top functions by cumulative time):")
+        pstats.Stats(self.profile).sort_stats("cumulative").print_stats(15)
+
+        return {
+            "stats_file": stats_file.name,
+            "peak_traced_memory": peak,
+            "top_allocations": [
+                {"location": str(stat.traceback[0]), "size": stat.size, "count": stat.count}
+                for stat in snapshot.statistics("lineno")[:10]
+            ],
+        }
+
+
+def write_run_metrics(exporter: MattermostExporter, output_dir: Path,
+                      pool: Optional[ExportProcessPool] = None,
+                      profiler: Optional[RunProfiler] = None) -> Path:
+    """Write the run's metrics (merged across worker processes) to
+    export_metrics.json in output_dir."""
+    reports = [exporter.metrics_report()]
+    if pool:
+        reports += pool.worker_metrics.values()
+    report = merge_metrics(reports)
+    if profiler:
+        report["profile"] = profiler.stop(output_dir)
+
+    metrics_file = output_dir / "export_metrics.json"
+    metrics_file.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    return metrics_file
+
+
+def summarize_results(results: List[Dict], skipped: Iterable[Dict] = ()) -> Dict:
+    """Merge channel export results, and the channels plan_from_args
+    skipped as unchanged, into export summary fields."""
+    workers: Dict[int, Dict] = {}
+    for result in results:
+        if "worker" in result:
+            # Counters are cumulative per process; keep each one's latest
+            worker = workers.setdefault(result["worker"]["pid"], {"channels": 0})
+            worker.update(result["worker"], channels=worker["channels"] + 1)
+
+    summary = {
+        "channels_exported": sum(1 for result in results if not result["error"]),
+        "failed_channels": [
+            {
+                "id": result["channel"]["id"],
+                "display_name": result["channel"]["display_name"],
+                "error": result["error"]
+            }
+            for result in results if result["error"]
+        ],
+        "skipped_channels": list(skipped)
+    }
+    if workers:
+        summary["processes"] = sorted(workers.values(), key=lambda worker: worker["pid"])
+    return summary
+
+
+def export_workspace(exporter: MattermostExporter, teams: List[Dict],
+                     args: argparse.Namespace, output_dir: Path, exports_root: Path,
+                     host: str, credentials: Dict,
+                     journal: Optional[ExportJournal] = None,
+                     download_files: bool = True,
+                     summary_fields: Optional[Dict] = None) -> Optional[Dict]:
+    """Export every channel of `teams`, plus the direct and group channels,
+    as the workspace scripts do.
+
+    The channels are planned together (see plan_from_args) and exported in
+    one pass, in worker processes with --processes or threads otherwise, so
+    the largest channels start first wherever they are. Run metrics go to
+    export_metrics.json and the summary (with `summary_fields` added) to
+    export_summary.json in output_dir. Returns the summary, or None for a
+    --dry-run. `credentials` are MattermostExporter's token or
+    username/password, used to connect worker processes.
+    """
+    # List every team's channels; direct and group channels, which the
+    # API repeats under each team, are exported once on their own
+    team_channels, direct_channels, memberships = exporter.list_workspace_channels(teams)
+    workspace_channels = [channel for team in teams for channel in team_channels[team["id"]]]
+    workspace_channels += direct_channels
+
+    print(f"\n{'='*60}")
+    print(f"Processing {len(workspace_channels)} channels across {len(teams)} teams "
+          f"and direct/group messages")
+    print(f"{'='*60}")
+
+    # Plan the whole workspace at once, so the largest channels start
+    # first and workers don't sit idle at team boundaries
+    channels, skipped = plan_from_args(exporter, workspace_channels, args)
+
+    # Export in worker processes sharing one rate budget, if asked to
+    pool = None
+    if args.processes > 1 and channels:
+        pool = ExportProcessPool(args.processes, args, host, exports_root, credentials)
+
+    profiler = RunProfiler() if args.profile and not args.dry_run else None
+
+    # Export channels (errors are reported per channel)
+    results = []
+    export_kwargs = {
+        "download_files": download_files,
+        "output_format": args.format,
+        "attachment_filter": attachment_filter_from_args(args),
+        "compression": args.compress,
+        "partition": args.partition,
+        "search_index": args.search_index,
+        "journal": journal
+    }
+    if pool:
+        results = pool.export_channels(channels, output_dir, **export_kwargs)
+    elif channels:
+        results = exporter.export_channels(channels, output_dir,
+                                           workers=args.workers, **export_kwargs)
+
+    if args.dry_run:
+        print("\nDry run: nothing exported")
+        return None
+    metrics_file = write_run_metrics(exporter, output_dir, pool, profiler)
+
+    summary = {
+        "host": host,
+        **(summary_fields or {}),
+        "exported_at": datetime.utcnow().isoformat() + "Z",
+        "teams_count": len(teams),
+        "total_channels": len(channels),
+        "teams": [
+            {
+                "name": team["name"],
+                "display_name": team["display_name"],
+                "id": team["id"],
+                "channels_count": len(team_channels[team["id"]])
+            }
+            for team in teams
+        ],
+        "direct_channels": [
+            {
+                "id": channel["id"],
+                "display_name": channel["display_name"],
+                "type": channel["type"],
+                "listed_in_teams": memberships[channel["id"]]
+            }
+            for channel in direct_channels
+        ],
+        **summarize_results(results, skipped)
+    }
+
+    summary_file = output_dir / "export_summary.json"
+    summary_file.write_text(json.dumps(summary, indent=2), encoding="utf-8")
+
+    print("\n" + "="*60)
+    print("✓ Export Complete!")
+    print(f"  Output: {output_dir.absolute()}")
+    print(f"  Teams: {len(teams)}")
+    print(f"  Channels: {len(channels)}")
+    print(f"  Metrics: {metrics_file.name}")
+    print(f"  Summary: {summary_file.name}")
+    print("="*60 + "\n")
+    return summary
+
+def open_metadata_cache(args: argparse.Namespace, host: str) -> Optional[MetadataCache]:
+    """Open the metadata cache selected by the add_export_arguments options."""
+    if args.no_cache:
+        return None
+    ttls = {"user": args.cache_ttl, "team": args.cache_ttl}
+    return MetadataCache(args.cache_db, host, ttls)
+
+
+def open_blob_store(args: argparse.Namespace, exports_root: Path) -> Optional[BlobStore]:
+    """Open the attachment blob store selected by the add_export_arguments options."""
+    if args.no_blob_store:
+        return None
+    return BlobStore(args.blob_store or exports_root / "blobs")
+
+
+def attachment_filter_from_args(args: argparse.Namespace) -> AttachmentFilter:
+    """Build the attachment filter selected by the add_export_arguments options."""
+    return AttachmentFilter(max_size=args.max_file_size,
+                            mime_allow=args.mime_allow,
+                            mime_deny=args.mime_deny,
+                            mode=args.files_mode)
+
+
 def interactive_config(config_file: Path) -> Dict:
     """Interactive configuration setup."""
     config = load_config(config_file)
@@ -445,6 +3648,10 @@ def main():
     parser.add_argument("--after", type=str, help="Export posts after date (YYYY-MM-DD)")
     parser.add_argument("--before", type=str, help="Export posts before date (YYYY-MM-DD)")
     parser.add_argument("--no-files", action="store_true", help="Skip downloading attachments")
+    parser.add_argument("--incremental", action="store_true",
+                       help="Sync into the output directory, fetching only posts changed "
+                            "since the last run (state kept in sync_manifest.json)")
+    add_export_arguments(parser)
 
     args = parser.parse_args()
 
@@ -460,49 +3667,83 @@ def main():
     before = datetime.strptime(args.before, "%Y-%m-%d") if args.before else None
     download_files = not args.no_files and config.get("download_files", True)
 
-    # Create output directory
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    output_dir = args.output / timestamp
-    output_dir.mkdir(parents=True, exist_ok=True)
-    print(f"\nOutput directory: {output_dir.absolute()}\n")
+    # Create output directory (incremental runs reuse one directory)
+    manifest = None
+    if args.resume:
+        if args.incremental:
+            parser.error("--resume cannot be combined with --incremental")
+        output_dir = args.resume
+        if not (output_dir / ExportJournal.FILE_NAME).exists():
+            parser.error(f"no interrupted export to resume in {output_dir}")
+    elif args.incremental:
+        output_dir = args.output
+        manifest = SyncManifest(output_dir / "sync_manifest.json")
+    else:
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        output_dir = args.output / timestamp
+    if not args.dry_run:
+        output_dir.mkdir(parents=True, exist_ok=True)
+        print(f"\nOutput directory: {output_dir.absolute()}\n")
 
     try:
         # Initialize exporter
-        exporter = MattermostExporter(
-            host=config["host"],
+        exporter = build_exporter(
+            args, config["host"], args.output,
             token=config.get("token"),
             username=config.get("username"),
             password=config.get("password")
         )
-        exporter.initialize_user_data()
-
-        # Select team and channels
-        team = exporter.select_team_interactive()
-        channels = exporter.select_channels_interactive(team["id"])
+        exporter.initialize_user_data(load_all_users=args.all_users)
+        journal = None if args.dry_run else open_export_journal(args, output_dir)
+
+        # Select team and channels (a resumed run reuses the original selection)
+        if journal and journal.meta:
+            channel_ids = set(journal.meta["channels"])
+            channels = [channel for channel in exporter.list_channels(journal.meta["team"])
+                        if channel["id"] in channel_ids]
+        else:
+            team = exporter.select_team_interactive()
+            channels = exporter.select_channels_interactive(team["id"])
+            if journal:
+                journal.start(team=team["id"], channels=[channel["id"] for channel in channels])
 
         if not channels:
             print("\nNo channels selected. Exiting.")
             return
 
+        channels, _ = plan_from_args(exporter, channels, args)
+        if args.dry_run or not channels:
+            return
+
         # Export channels
         print(f"\nExporting {len(channels)} channel(s)...\n")
-        for idx, channel in enumerate(channels, 1):
-            print(f"\n[{idx}/{len(channels)}]")
-            exporter.export_channel(
-                channel,
-                output_dir,
-                download_files=download_files,
-                after=after,
-                before=before
-            )
+        profiler = RunProfiler() if args.profile else None
+        exporter.export_channels(
+            channels,
+            output_dir,
+            workers=args.workers,
+            download_files=download_files,
+            after=after,
+            before=before,
+            manifest=manifest,
+            output_format=args.format,
+            attachment_filter=attachment_filter_from_args(args),
+            journal=journal,
+            compression=args.compress,
+            partition=args.partition,
+            search_index=args.search_index
+        )
+        metrics_file = write_run_metrics(exporter, output_dir, profiler=profiler)
 
         print("\n" + "="*60)
         print("✓ Export complete!")
         print(f"  Output: {output_dir.absolute()}")
+        print(f"  Metrics: {metrics_file.name}")
         print("="*60 + "\n")
 
     except KeyboardInterrupt:
         print("\n\n✗ Export cancelled by user")
+        print(f"  Resume with: --resume {output_dir}")
     except Exception as e:
         print(f"\n✗ Error: {e}")
         import traceback
@@ -0,0 +1,216 @@
+"""
+Tests for mattermost_export against the benchmark's mock Mattermost server.
+
+Run with: python -m pytest test_mattermost_export.py
+"""
+
+import threading
+from datetime import datetime, timezone
+
+import pytest
+
+from mattermost_bench import MockServer, Workspace
+from mattermost_export import (
+    AttachmentFilter, ExportJournal, MattermostExporter, SyncManifest, iter_exported_posts
+)
+
+
+# 450 posts per channel: three pages of POSTS_PER_PAGE, the last one short
+POSTS_PER_CHANNEL = 450
+
+
+@pytest.fixture
+def server():
+    server = MockServer(0, Workspace(users=10, teams=1, channels=2,
+                                     posts=POSTS_PER_CHANNEL, files_every=40,
+                                     file_size=2_000))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def connect(server: MockServer, **kwargs) -> MattermostExporter:
+    exporter = MattermostExporter("127.0.0.1", token="test", port=server.server_address[1],
+                                  scheme="http", **kwargs)
+    exporter.initialize_user_data()
+    return exporter
+
+
+def team_channels(server: MockServer):
+    workspace = server.workspace
+    return [channel for channel in workspace.team_channels[workspace.teams[0]["id"]]
+            if channel["type"] == "O"]
+
+
+def exported_posts(output_dir, channel):
+    export_file = output_dir / channel["name"] / f"{channel['name']}.json"
+    return list(iter_exported_posts(export_file))
+
+
+def page_requests(server: MockServer) -> int:
+    return server.counts.get("GET /channels/{id}/posts", 0)
+
+
+@pytest.mark.parametrize("attachment_filter, file_info, reason", [
+    # Original mode: allow list, deny list and size limit
+    (AttachmentFilter(mime_allow=["image/*"]),
+     {"mime_type": "application/pdf", "size": 10}, "type application/pdf not allowed"),
+    (AttachmentFilter(mime_deny=["video/*"]), {"mime_type": "video/mp4", "size": 10},
+     "type video/mp4 denied"),
+    (AttachmentFilter(max_size=1024), {"mime_type": "image/png", "size": 4096},
+     "4.0 KB over size limit"),
+    (AttachmentFilter(max_size=1024, mime_allow=["image/*"]),
+     {"mime_type": "image/png", "size": 512}, None),
+    # Preview mode: files without a preview are skipped unless allowed
+    (AttachmentFilter(mode="preview"),
+     {"mime_type": "video/mp4", "size": 10, "has_preview_image": False}, "no preview"),
+    (AttachmentFilter(mode="preview", mime_allow=["video/*"]),
+     {"mime_type": "video/mp4", "size": 10, "has_preview_image": False}, None),
+    (AttachmentFilter(mode="thumbnail"),
+     {"mime_type": "image/png", "size": 10, "has_preview_image": True}, None),
+    # ...and the deny list and size limit still apply to previews
+    (AttachmentFilter(mode="preview", mime_deny=["image/*"]),
+     {"mime_type": "image/png", "size": 10, "has_preview_image": True},
+     "type image/png denied"),
+    (AttachmentFilter(mode="thumbnail", max_size=1024),
+     {"mime_type": "image/png", "size": 4096, "has_preview_image": True},
+     "4.0 KB over size limit"),
+])
+def test_attachment_filter_skip_reason(attachment_filter, file_info, reason):
+    assert attachment_filter.skip_reason(file_info) == reason
+
+
+def test_attachment_filter_rendition():
+    with_preview = {"mime_type": "image/png", "has_preview_image": True}
+    without_preview = {"mime_type": "application/zip", "has_preview_image": False}
+    assert AttachmentFilter().rendition(with_preview) == "original"
+    assert AttachmentFilter(mode="thumbnail").rendition(with_preview) == "thumbnail"
+    assert AttachmentFilter(mode="preview").rendition(without_preview) == "original"
+
+
+def test_preview_mode_skips_files_without_previews(server, tmp_path):
+    channel = team_channels(server)[0]
+    exporter = connect(server, blob_store=None)
+    exporter.export_channels([channel], tmp_path,
+                             attachment_filter=AttachmentFilter(mode="preview"))
+
+    posts = [post for post in exported_posts(tmp_path, channel) if post.get("files")]
+    assert posts
+    for post in posts:
+        assert post["files_skipped"] == [{"name": name, "reason": "no preview"}
+                                         for name in post["files"]]
+    assert not list((tmp_path / channel["name"]).glob("*.bin"))
+    assert server.counts.get("GET /files/{id}", 0) == 0
+
+
+def test_resume_continues_interrupted_export(server, tmp_path):
+    first, second = team_channels(server)
+    fresh_dir, resumed_dir = tmp_path / "fresh", tmp_path / "resumed"
+
+    requests_before = page_requests(server)
+    connect(server, prefetch_pages=1).export_channels([first, second], fresh_dir)
+    fresh_requests = page_requests(server) - requests_before
+
+    # Interrupt the second channel after its first page is checkpointed
+    exporter = connect(server, prefetch_pages=1)
+    iter_post_pages = exporter._iter_post_pages
+
+    def interrupted_pages(channel_id, *args, **kwargs):
+        pages = iter_post_pages(channel_id, *args, **kwargs)
+        yield next(pages)
+        if channel_id == second["id"]:
+            raise KeyboardInterrupt
+        yield from pages
+
+    exporter._iter_post_pages = interrupted_pages
+    resumed_dir.mkdir()
+    journal = ExportJournal(resumed_dir)
+    with pytest.raises(KeyboardInterrupt):
+        exporter.export_channels([first, second], resumed_dir, journal=journal)
+    journal.close()
+    assert journal.is_done(first["id"])
+    assert not journal.is_done(second["id"])
+
+    # The resumed run skips the finished channel and the fetched page
+    requests_before = page_requests(server)
+    journal = ExportJournal(resumed_dir, resume=True)
+    connect(server, prefetch_pages=1).export_channels([first, second], resumed_dir,
+                                                      journal=journal)
+    journal.close()
+    resumed_requests = page_requests(server) - requests_before
+    assert resumed_requests < fresh_requests // 2
+
+    for channel in (first, second):
+        assert exported_posts(resumed_dir, channel) == exported_posts(fresh_dir, channel)
+        assert (sorted(path.name for path in (resumed_dir / channel["name"]).glob("*.bin"))
+                == sorted(path.name for path in (fresh_dir / channel["name"]).glob("*.bin")))
+    assert not list(resumed_dir.rglob(".pages.tmp"))
+
+
+def without_code_offsets(posts):
+    # Incremental syncs append new snippets to the code archive, so their
+    # offsets differ from a fresh export's; everything else must match
+    return [{key: value for key, value in post.items() if key != "code_blocks"}
+            for post in posts]
+
+
+@pytest.mark.parametrize("bounded", [False, True], ids=["full", "before"])
+def test_incremental_sync_matches_fresh_export(server, tmp_path, bounded):
+    workspace = server.workspace
+    channel = team_channels(server)[0]
+    ids = workspace.channel_posts[channel["id"]]
+    synced_dir, fresh_dir = tmp_path / "synced", tmp_path / "fresh"
+    manifest_file = synced_dir / "sync_manifest.json"
+
+    # First sync, optionally stopping halfway through the channel
+    before = None
+    if bounded:
+        before = datetime.fromtimestamp(workspace.posts[ids[len(ids) // 2]]["create_at"]
+                                        / 1000, timezone.utc)
+    connect(server).export_channels([channel], synced_dir, before=before,
+                                    manifest=SyncManifest(manifest_file))
+
+    # Edit an old post (well after any --before bound) and add new posts,
+    # one of them a reply and one with an attachment
+    last_created = workspace.posts[ids[-1]]["create_at"]
+    edited = workspace.posts[ids[10]]
+    edited.update(message="Edited message", update_at=last_created + 3_600_000)
+    for offset in range(1, 4):
+        post_id = f"n{offset:025d}"
+        created = last_created + offset * 60_000
+        post = dict(workspace.posts[ids[-1]], id=post_id, create_at=created,
+                    update_at=created, message=f"New message {offset}", root_id="",
+                    metadata={})
+        if offset == 2:
+            post["root_id"] = ids[0]
+        if offset == 3:
+            file_id = f"g{offset:025d}"
+            workspace.files[file_id] = 100
+            post["metadata"] = {"files": [{
+                "id": file_id, "name": "new.bin", "size": 100,
+                "mime_type": "application/octet-stream", "extension": "bin",
+                "has_preview_image": False,
+            }]}
+        workspace.posts[post_id] = post
+        ids.append(post_id)
+    channel["last_post_at"] = workspace.posts[ids[-1]]["create_at"]
+
+    connect(server).export_channels([channel], synced_dir,
+                                    manifest=SyncManifest(manifest_file))
+    connect(server).export_channels([channel], fresh_dir)
+
+    synced = exported_posts(synced_dir, channel)
+    assert len(synced) == len(ids)
+    assert synced[10]["message"] == "Edited message"
+    assert without_code_offsets(synced) == without_code_offsets(
+        exported_posts(fresh_dir, channel))
+    assert (synced_dir / channel["name"] / "0452_new.bin").exists()
+
+    # Nothing changed since: the next sync leaves the export alone
+    export_file = synced_dir / channel["name"] / f"{channel['name']}.json"
+    modified = export_file.stat().st_mtime_ns
+    connect(server).export_channels([channel], synced_dir,
+                                    manifest=SyncManifest(manifest_file))
+    assert export_file.stat().st_mtime_ns == modified